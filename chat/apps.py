@@ -7,22 +7,35 @@ class ChatConfig(AppConfig):
 
     def ready(self):
         # Register models with the admin site
-        from django.contrib import admin
-        from . import models
+        from django.contrib import admin, messages
+        from django.conf import settings
+        from floracouture.admin_base import AutocompleteFilter, LargeTableAdmin
+        from . import models, signals  # noqa: F401
+        from .search import FullTextSearchMixin
+
+        if getattr(settings, 'CHATBOT_WEBSOCKET_DEFLATE', False):
+            from .deflate import install
+            install()
 
         @admin.register(models.ChatbotSession)
-        class ChatbotSessionAdmin(admin.ModelAdmin):
+        class ChatbotSessionAdmin(LargeTableAdmin):
             list_display = ('customer', 'created_at',
                             'last_activity', 'is_active')
-            list_filter = ('is_active', 'created_at')
+            list_filter = ('is_active', 'created_at', ('customer', AutocompleteFilter))
+            list_select_related = ('customer',)
             search_fields = ('customer__username',)
+            autocomplete_fields = ('customer',)
 
         @admin.register(models.ChatbotMessage)
-        class ChatbotMessageAdmin(admin.ModelAdmin):
+        class ChatbotMessageAdmin(FullTextSearchMixin, LargeTableAdmin):
             list_display = ('get_customer', 'is_bot',
                             'content_preview', 'timestamp')
-            list_filter = ('is_bot', 'timestamp')
+            list_filter = ('is_bot', 'timestamp', ('session__customer', AutocompleteFilter))
+            list_select_related = ('session__customer',)
             search_fields = ('content', 'session__customer__username')
+            search_kind = 'chatbot'
+            search_exact = ('session__customer__username',)
+            raw_id_fields = ('session',)
 
             def get_customer(self, obj):
                 return obj.session.customer.username
@@ -32,6 +45,31 @@ class ChatConfig(AppConfig):
                 return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
             content_preview.short_description = 'Content'
 
+        @admin.register(models.ChatMessage)
+        class ChatMessageAdmin(FullTextSearchMixin, LargeTableAdmin):
+            list_display = ('session', 'is_bot', 'message_preview', 'timestamp')
+            list_filter = ('is_bot',)
+            list_select_related = ('session',)
+            search_fields = ('message',)
+            search_kind = 'chat'
+            raw_id_fields = ('session',)
+
+            def message_preview(self, obj):
+                return obj.message[:50] + '...' if len(obj.message) > 50 else obj.message
+            message_preview.short_description = 'Message'
+
+        @admin.register(models.Message)
+        class MessageAdmin(FullTextSearchMixin, LargeTableAdmin):
+            list_display = ('room_id', 'sender_type', 'content_preview', 'timestamp')
+            list_filter = ('sender_type',)
+            search_fields = ('content',)
+            search_kind = 'room'
+            raw_id_fields = ('room',)
+
+            def content_preview(self, obj):
+                return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
+            content_preview.short_description = 'Content'
+
         @admin.register(models.BotResponse)
         class BotResponseAdmin(admin.ModelAdmin):
             list_display = ('category', 'keywords_preview',
@@ -46,3 +84,28 @@ class ChatConfig(AppConfig):
             def response_preview(self, obj):
                 return obj.response_text[:50] + '...' if len(obj.response_text) > 50 else obj.response_text
             response_preview.short_description = 'Response'
+
+        @admin.register(models.Broadcast)
+        class BroadcastAdmin(admin.ModelAdmin):
+            list_display = ('message_preview', 'created_at', 'sent_at', 'delivered')
+            readonly_fields = ('sent_at', 'delivered')
+            actions = ['send_broadcasts']
+
+            def message_preview(self, obj):
+                return obj.message[:50] + '...' if len(obj.message) > 50 else obj.message
+            message_preview.short_description = 'Message'
+
+            @admin.action(description='Send selected broadcasts to all connected chatbots')
+            def send_broadcasts(self, request, queryset):
+                from .broadcast import LOCAL_LAYER_ERROR, layer_is_local, send_broadcast
+
+                if layer_is_local():
+                    # Admin requests are not served by the processes holding the sockets
+                    self.message_user(request, LOCAL_LAYER_ERROR, level=messages.ERROR)
+                    return
+                for broadcast in queryset:
+                    delivered = send_broadcast(broadcast)
+                    count = 'an unknown number of' if delivered is None else delivered
+                    self.message_user(
+                        request, f'"{broadcast.message[:30]}" delivered to {count} sockets')
+
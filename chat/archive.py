@@ -0,0 +1,107 @@
+"""
+Cold storage for old chat messages.
+
+Once a chatbot session or chat room has been idle for a while, its
+messages are packed into one zlib-compressed msgpack blob in
+``ArchivedTranscript`` and the hot rows are deleted in small batches. Readers
+use ``archived_messages`` to get the rows back as unsaved model instances,
+so archived and live messages look the same to views. Only kinds whose
+readers do that are archived: the chatbot history and the room backlog.
+Legacy chat session messages have no reader, so they stay in the hot table.
+"""
+import zlib
+from collections import defaultdict
+
+import msgpack
+from django.db import transaction
+from django.db.models import Max
+
+from .models import ArchivedTranscript, ChatbotMessage, ChatMessage, Message
+
+# kind -> (message model, foreign key to the parent, archived fields)
+SOURCES = {
+    'chatbot': (ChatbotMessage, 'session', ('is_bot', 'content', 'timestamp')),
+    'chat': (ChatMessage, 'session', ('is_bot', 'message', 'timestamp')),
+    'room': (Message, 'room', ('sender_type', 'content', 'timestamp')),
+}
+
+# Kinds whose readers merge archived messages back in
+ARCHIVED_KINDS = ('chatbot', 'room')
+
+
+def pack(rows):
+    return zlib.compress(msgpack.packb(rows, datetime=True))
+
+
+def unpack(payload):
+    return msgpack.unpackb(zlib.decompress(bytes(payload)), timestamp=3)
+
+
+def idle_sources(kind, cutoff, limit, after=0):
+    """
+    Ids above ``after`` of parents whose newest message is older than
+    ``cutoff``, in id order.
+
+    Each pass walks the ``(parent, timestamp)`` index forward from ``after``,
+    so passing the last id back in keeps a whole run to one walk of the index.
+    """
+    model, parent, _ = SOURCES[kind]
+    return list(
+        model.objects.filter(**{f'{parent}__gt': after}).values(parent)
+        .annotate(last=Max('timestamp'))
+        .filter(last__lt=cutoff)
+        .order_by(parent)
+        .values_list(parent, flat=True)[:limit]
+    )
+
+
+def archive_source(kind, source_id, batch_size=500):
+    """Pack one parent's messages into an archive row, then delete them"""
+    if kind not in ARCHIVED_KINDS:
+        raise ValueError(f'{kind} messages are not archived')
+    model, parent, fields = SOURCES[kind]
+    rows = list(
+        model.objects.filter(**{parent: source_id})
+        .order_by('timestamp', 'pk')
+        .values('id', *fields)
+    )
+    if not rows:
+        return 0
+
+    ArchivedTranscript.objects.create(
+        kind=kind,
+        source_id=source_id,
+        message_count=len(rows),
+        first_timestamp=rows[0]['timestamp'],
+        last_timestamp=rows[-1]['timestamp'],
+        payload=pack(rows),
+    )
+
+    # Short transactions keep row locks brief on the hot table. If the job
+    # dies part way, the next run archives the leftovers again and readers
+    # drop the duplicates by id.
+    ids = [row['id'] for row in rows]
+    for start in range(0, len(ids), batch_size):
+        with transaction.atomic():
+            model.objects.filter(pk__in=ids[start:start + batch_size]).delete()
+    return len(rows)
+
+
+def archived_messages(kind, source_ids):
+    """Return {source id: [unsaved message instances]} from the archive"""
+    if not source_ids:
+        return {}
+
+    model, parent, _ = SOURCES[kind]
+    messages = defaultdict(dict)
+    archives = ArchivedTranscript.objects.filter(
+        kind=kind, source_id__in=source_ids).order_by('pk')
+    for archive in archives:
+        for row in unpack(archive.payload):
+            row[f'{parent}_id'] = archive.source_id
+            messages[archive.source_id][row['id']] = model(**row)
+
+    return {
+        source_id: sorted(by_id.values(), key=lambda m: (m.timestamp, m.pk))
+        for source_id, by_id in messages.items()
+    }
@@ -0,0 +1,73 @@
+"""
+Announcements to every connected chatbot socket.
+
+Each ChatbotConsumer joins one of ``CHATBOT_BROADCAST_SHARDS`` broadcast
+groups, picked from its session_id. A broadcast is encoded once and handed
+to the channel layer with one ``group_send`` per shard, so the layer does
+the fan-out in batches to every worker instead of the sender looping over
+sessions. Broadcasts are not part of a session's conversation and carry no
+``seq``.
+"""
+import zlib
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from .codec import frames_event
+
+GROUP_PREFIX = 'chatbot_broadcast_'
+
+LOCAL_LAYER_ERROR = (
+    'The channel layer is in-memory, so a broadcast from this process '
+    'reaches no sockets. Configure a shared layer (chat.layers.'
+    'UnixSocketChannelLayer or Redis) in CHANNEL_LAYERS.')
+
+
+def shard_count():
+    return getattr(settings, 'CHATBOT_BROADCAST_SHARDS', 16)
+
+
+def layer_is_local():
+    """Whether the channel layer's groups live in this process only"""
+    return isinstance(get_channel_layer(), InMemoryChannelLayer)
+
+
+def broadcast_group(session_id):
+    # crc32 rather than hash(), which differs between worker processes
+    return f'{GROUP_PREFIX}{zlib.crc32(session_id.encode()) % shard_count()}'
+
+
+async def abroadcast(message):
+    """
+    Push ``message`` to every connected chatbot socket.
+
+    Returns how many sockets the channel layer accepted it for, or None
+    when the layer does not report it.
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return 0
+
+    event = frames_event({'message': message, 'sender': 'bot', 'broadcast': True})
+    delivered = 0
+    for shard in range(shard_count()):
+        group = f'{GROUP_PREFIX}{shard}'
+        # The in-memory layer returns nothing from group_send but exposes its groups
+        groups = getattr(layer, 'groups', None)
+        members = len(groups.get(group, ())) if groups is not None else None
+        accepted = await layer.group_send(group, event)
+        if accepted is None:
+            accepted = members
+        if delivered is not None:
+            delivered = None if accepted is None else delivered + accepted
+    return delivered
+
+
+def send_broadcast(broadcast):
+    """Send a saved Broadcast and record when and to how many sockets"""
+    broadcast.delivered = async_to_sync(abroadcast)(broadcast.message)
+    broadcast.sent_at = timezone.now()
+    broadcast.save(update_fields=['delivered', 'sent_at'])
+    return broadcast.delivered
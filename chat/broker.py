@@ -0,0 +1,242 @@
+"""
+Single-host message broker behind ``chat.layers.UnixSocketChannelLayer``.
+
+One broker process owns every channel queue and group on the machine and
+the daphne workers talk to it over a Unix domain socket, so group messages
+reach sockets held by any worker without an external service like Redis.
+
+Frames are msgpack arrays streamed back to back. Message bodies are packed
+once by the sending worker and stored and forwarded as opaque bytes, so a
+group send to N channels costs one encode no matter how large N is.
+
+Requests are ``[op, request id, *args]`` and every one is answered with
+``['ok', request id, value]`` or ``['full', request id, channel]``:
+
+    ['hello', id, capacity, channel_capacity, expiry]
+    ['send', id, channel, body]
+    ['receive', id, channel]             answered once a message arrives
+    ['cancel', id]                       drop a pending receive, no answer
+    ['group_add', id, group, channel, group_expiry]
+    ['group_discard', id, group, channel]
+    ['group_send', id, group, body]      answered with the delivered count
+    ['flush', id]
+"""
+import asyncio
+import logging
+import os
+import stat
+import time
+from collections import defaultdict, deque
+
+import msgpack
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+# Under the project rather than a world-writable directory like /tmp
+DEFAULT_SOCKET_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'run', 'channels.sock')
+
+
+class BrokerRunning(RuntimeError):
+    """Another broker is already listening on the socket path"""
+
+
+class _Client:
+    def __init__(self, writer):
+        self.writer = writer
+        # Capacity and expiry come from the worker's own layer config
+        self.config = BaseChannelLayer()
+        self.waiting = set()
+
+    def reply(self, *frame):
+        if not self.writer.is_closing():
+            self.writer.write(msgpack.packb(frame, use_bin_type=True))
+
+
+class Broker:
+    def __init__(self, path=DEFAULT_SOCKET_PATH, sweep_interval=1.0):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.server = None
+        # channel -> deque of (expires at, body)
+        self.channels = defaultdict(deque)
+        # channel -> deque of (client, request id) blocked in receive
+        self.waiters = defaultdict(deque)
+        # group -> {channel: expires at}
+        self.groups = defaultdict(dict)
+        self._sweeper = None
+
+    async def _remove_stale_socket(self):
+        """Delete a socket left behind by a broker that died, refusing to touch a live one"""
+        try:
+            mode = os.stat(self.path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise BrokerRunning(f'{self.path} exists and is not a socket')
+        try:
+            _, writer = await asyncio.open_unix_connection(self.path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(self.path)
+            return
+        writer.close()
+        raise BrokerRunning(f'A broker is already listening on {self.path}')
+
+    async def start(self):
+        os.makedirs(os.path.dirname(self.path) or '.', mode=0o700, exist_ok=True)
+        await self._remove_stale_socket()
+        self.server = await asyncio.start_unix_server(self._serve, path=self.path)
+        self._sweeper = asyncio.ensure_future(self._sweep_forever())
+        return self
+
+    async def close(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def _serve(self, reader, writer):
+        client = _Client(writer)
+        unpacker = msgpack.Unpacker(raw=False)
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                unpacker.feed(data)
+                for frame in unpacker:
+                    self.handle(client, frame)
+                # One drain per read keeps replies batched under load
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.exception('Channel broker dropped a client')
+        finally:
+            for channel, request_id in client.waiting:
+                waiters = self.waiters.get(channel)
+                if waiters:
+                    try:
+                        waiters.remove((client, request_id))
+                    except ValueError:
+                        pass
+            writer.close()
+
+    def handle(self, client, frame):
+        op, request_id, *args = frame
+        if op == 'send':
+            channel, body = args
+            if self.push(channel, body, client.config):
+                client.reply('ok', request_id, None)
+            else:
+                client.reply('full', request_id, channel)
+        elif op == 'receive':
+            self.receive(client, request_id, args[0])
+        elif op == 'cancel':
+            self.cancel(client, request_id)
+        elif op == 'group_add':
+            group, channel, group_expiry = args
+            self.groups[group][channel] = time.time() + group_expiry
+            client.reply('ok', request_id, None)
+        elif op == 'group_discard':
+            group, channel = args
+            members = self.groups.get(group)
+            if members is not None:
+                members.pop(channel, None)
+                if not members:
+                    del self.groups[group]
+            client.reply('ok', request_id, None)
+        elif op == 'group_send':
+            group, body = args
+            delivered = sum(
+                self.push(channel, body, client.config)
+                for channel in list(self.groups.get(group, ()))
+            )
+            client.reply('ok', request_id, delivered)
+        elif op == 'hello':
+            capacity, channel_capacity, expiry = args
+            config = BaseChannelLayer(expiry=expiry, capacity=capacity)
+            config.channel_capacity = config.compile_capacities(dict(channel_capacity))
+            client.config = config
+            client.reply('ok', request_id, None)
+        elif op == 'flush':
+            self.channels.clear()
+            self.groups.clear()
+            client.reply('ok', request_id, None)
+        else:
+            logger.warning('Channel broker got unknown op %r', op)
+
+    def push(self, channel, body, config):
+        """Hand ``body`` to a blocked receiver or queue it; False when full"""
+        waiters = self.waiters.get(channel)
+        while waiters:
+            client, request_id = waiters.popleft()
+            client.waiting.discard((channel, request_id))
+            if not client.writer.is_closing():
+                client.reply('ok', request_id, body)
+                return True
+        queue = self.channels[channel]
+        if len(queue) >= config.get_capacity(channel):
+            return False
+        queue.append((time.time() + config.expiry, body))
+        return True
+
+    def receive(self, client, request_id, channel):
+        queue = self.channels.get(channel)
+        now = time.time()
+        while queue:
+            expires, body = queue.popleft()
+            if expires >= now:
+                client.reply('ok', request_id, body)
+                return
+        self.channels.pop(channel, None)
+        self.waiters[channel].append((client, request_id))
+        client.waiting.add((channel, request_id))
+
+    def cancel(self, client, request_id):
+        for channel, waiting_id in list(client.waiting):
+            if waiting_id == request_id:
+                client.waiting.discard((channel, waiting_id))
+                self.waiters[channel].remove((client, waiting_id))
+                if not self.waiters[channel]:
+                    del self.waiters[channel]
+
+    def sweep(self):
+        """Drop expired messages and group memberships"""
+        now = time.time()
+        for channel, queue in list(self.channels.items()):
+            expired = False
+            while queue and queue[0][0] < now:
+                queue.popleft()
+                expired = True
+            if not queue:
+                del self.channels[channel]
+            # Like the in-memory layer, a channel nobody reads leaves its groups
+            if expired:
+                for members in self.groups.values():
+                    members.pop(channel, None)
+        for group, members in list(self.groups.items()):
+            for channel, expires in list(members.items()):
+                if expires < now:
+                    del members[channel]
+            if not members:
+                del self.groups[group]
+        for channel, waiters in list(self.waiters.items()):
+            if not waiters:
+                del self.waiters[channel]
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
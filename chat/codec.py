@@ -0,0 +1,53 @@
+"""
+Wire encodings for chatbot sockets.
+
+Clients speak JSON text frames unless they negotiate the ``msgpack``
+WebSocket subprotocol, in which case every frame in both directions is a
+binary msgpack document with the same shape as the JSON one.
+"""
+import json
+
+import msgpack
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+
+def negotiate(subprotocols):
+    """The codec for a connection, from the subprotocols the client offered"""
+    return MSGPACK if MSGPACK in subprotocols else JSON
+
+
+def encode(payload, codec):
+    """``send()`` keyword arguments carrying ``payload`` in ``codec``"""
+    if codec == MSGPACK:
+        return {'bytes_data': msgpack.packb(payload, use_bin_type=True)}
+    return {'text_data': json.dumps(payload)}
+
+
+class DecodeError(ValueError):
+    """A frame that is not a valid document in the connection's codec"""
+
+
+def decode(text_data, bytes_data, codec):
+    """The document in an inbound frame; raises ``DecodeError`` if it is malformed"""
+    try:
+        if codec == MSGPACK and bytes_data is not None:
+            return msgpack.unpackb(bytes_data, raw=False)
+        return json.loads(text_data if text_data is not None else bytes_data)
+    except (ValueError, TypeError, msgpack.UnpackException) as e:
+        raise DecodeError(f'Frames must be {codec} documents') from e
+
+
+def frames_event(payload):
+    """
+    A ``bot.frames`` group message with ``payload`` already encoded.
+
+    Each encoding is done once here, however many sockets the group holds;
+    consumers only pick the one their client negotiated.
+    """
+    return {
+        'type': 'bot.frames',
+        JSON: json.dumps(payload),
+        MSGPACK: msgpack.packb(payload, use_bin_type=True),
+    }
@@ -1,63 +1,457 @@
+import asyncio
 import json
+import re
+import time
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.utils import timezone
+from django.utils.html import escape
+from django.utils.dateparse import parse_datetime
+
+from orders.status import aget_order_status
+from products.index import product_index
+
+from .broadcast import broadcast_group
+from .codec import MSGPACK, DecodeError, decode, encode, negotiate
+from .cursors import InvalidCursor
+from .matcher import normalize
+from .persistence import create_session, transcript_buffer
+from .replay import replay_store
+from .reply_cache import MISSING, reply_cache
+from .rooms import (
+    BACKLOG_PAGE_SIZE, backlog_page, mark_room_read, room_buffer, room_side, serialize_message,
+)
+from .rules import EMPTY_SNAPSHOT, rule_cache
+from .throttle import throttle
+
+EMPTY_MESSAGE_REPLY = "I didn't catch that. Could you please repeat?"
+DEFAULT_REPLY = "Thank you for your message. How else can I assist you with your floral needs today?"
+
+# "order 12", "order number 12", "order no 12", "order id 12"
+ORDER_ID_RE = re.compile(r'\border (?:(number|no|id) )?(\d{1,18})\b')
+TRACKING_RE = re.compile(r'\b(?:track|tracking|status|where|check)\b')
+# A reply made of nothing but an order reference, e.g. "order 12"
+BARE_ORDER_ID_RE = re.compile(r'order (?:(?:number|no|id) )?(\d{1,18})')
+# "#12", checked on the raw text since normalising drops the "#"
+HASH_ORDER_ID_RE = re.compile(r'#\s?(\d{1,18})\b')
+
+
+def parse_order_id(message):
+    """
+    Return the order number a message asks about, or None.
+
+    A number only counts with an order keyword or a "#" in front of it.
+    Inside a longer sentence it also has to sit next to a tracking word, so
+    "can I order 12 roses" is not mistaken for an order lookup.
+    """
+    text = normalize(message)
+    match = BARE_ORDER_ID_RE.fullmatch(text)
+    if match is not None:
+        return int(match.group(1))
+
+    match = HASH_ORDER_ID_RE.search(message)
+    if match is not None:
+        if match.group(0) == message.strip() or TRACKING_RE.search(text):
+            return int(match.group(1))
+        return None
+
+    match = ORDER_ID_RE.search(text)
+    if match is None:
+        return None
+    if match.group(1) or TRACKING_RE.search(text):
+        return int(match.group(2))
+    return None
+
+
+def message_text(item):
+    """The text of one inbound message: a string or ``{"message": ...}``"""
+    if isinstance(item, dict):
+        item = item.get('message', '')
+    return item if isinstance(item, str) else ''
+
+
+def product_reply(products):
+    # Retailers name products and the chat page renders bot replies as HTML
+    listing = ', '.join(f"{escape(p.name)} (₹{p.price})" for p in products)
+    return f"Here's what we have in stock: {listing}. Would you like to order one?"
 
 
 class ChatbotConsumer(AsyncWebsocketConsumer):
+    rules = EMPTY_SNAPSHOT
+    chatbot_session_id = None
+    # Close code sent to sockets that keep ignoring the rate limit
+    THROTTLE_CLOSE_CODE = 4008
+
     async def connect(self):
         self.session_id = self.scope['url_route']['kwargs']['session_id']
+        self.bucket = throttle.connection_bucket()
+        self.throttled_frames = 0
+        # Batch framing: replies go out as arrays, coalesced over a short window
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.batch_mode = 'batch' in query.get('framing', ())
+        self.outbox = []
+        self.outbox_task = None
+        # Outbound messages are numbered per session so clients can resume
+        self.replay = replay_store.get(self.session_id)
+        try:
+            last_seq = int(query['last_seq'][0])
+        except (KeyError, ValueError):
+            last_seq = None
+        self.codec = negotiate(self.scope.get('subprotocols', ()))
         self.room_group_name = f"chatbot_{self.session_id}"
+        self.broadcast_group_name = broadcast_group(self.session_id)
+        self.rules = await rule_cache.aget()
 
-        # Join room group if channel layer exists
+        # Join room and broadcast groups if channel layer exists
         if self.channel_layer is not None:
             await self.channel_layer.group_add(
                 self.room_group_name,
                 self.channel_name
             )
-        await self.accept()
+            await self.channel_layer.group_add(
+                self.broadcast_group_name,
+                self.channel_name
+            )
+        await self.accept(subprotocol=MSGPACK if self.codec == MSGPACK else None)
 
-        # Send welcome message
-        await self.send(text_data=json.dumps({
-            "message": "Hello! How can I help you with your floral needs today?",
-            "sender": "bot",
-        }))
+        # A resumed socket only gets what it missed; anything else starts over
+        missed = self.replay.since(last_seq) if last_seq is not None else None
+        if missed is None:
+            await self.send_bot("Hello! How can I help you with your floral needs today?")
+        else:
+            await self.send_payloads(missed)
+        await self.flush_soon()
 
     async def disconnect(self, close_code):
-        # Leave room group if channel layer exists
+        if self.outbox_task is not None:
+            self.outbox_task.cancel()
+
+        # Leave room and broadcast groups if channel layer exists
         if self.channel_layer is not None:
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
+            await self.channel_layer.group_discard(
+                self.broadcast_group_name,
+                self.channel_name
+            )
 
-    async def receive(self, text_data):
-        # Parse incoming data
-        data = json.loads(text_data)
-        message = data.get('message', '')
+        # Close the transcript and write out whatever is still buffered
+        if self.chatbot_session_id is not None:
+            transcript_buffer.close_session(self.chatbot_session_id)
+            await transcript_buffer.flush()
 
-        # Get bot response
-        bot_response = self.get_bot_response(message)
+    async def receive(self, text_data=None, bytes_data=None):
+        # Rate limit before doing any work on the frame
+        if not throttle.allow(self.bucket, self.session_id):
+            self.throttled_frames += 1
+            if self.throttled_frames == throttle.close_after:
+                throttle.closed += 1
+                await self.close(code=self.THROTTLE_CLOSE_CODE)
+            return
 
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'message': bot_response,
-            'sender': 'bot'
-        }))
+        # Parse incoming data; a malformed frame gets an error, not a dropped socket
+        try:
+            data = decode(text_data, bytes_data, self.codec)
+        except DecodeError as e:
+            await self.send(**encode({'type': 'error', 'error': str(e)}, self.codec))
+            return
+        if isinstance(data, list):
+            # Clients that send arrays get arrays back
+            self.batch_mode = True
+            messages = [message_text(item) for item in data[:self.max_batch]]
+            # The frame paid for its first message; charge the rest too
+            allowed = min(len(messages), 1)
+            while allowed < len(messages) and throttle.allow(self.bucket, self.session_id):
+                allowed += 1
+            messages = messages[:allowed]
+        else:
+            messages = [message_text(data)]
+
+        self.rules = await rule_cache.aget()
+        await product_index.aget()
+
+        for message in messages:
+            bot_response = await self.reply_to(message)
+            await self.send_bot(bot_response)
+            await self.record(message, bot_response)
+        await self.flush_soon()
+
+    @property
+    def max_batch(self):
+        return getattr(settings, 'CHATBOT_MAX_BATCH_MESSAGES', 20)
+
+    async def reply_to(self, message):
+        # Order lookups are per user, so they skip the reply cache
+        order_id = parse_order_id(message) if message else None
+        if order_id is not None:
+            return await self.order_status_reply(order_id)
+        return self.get_bot_response(message)
+
+    async def send_bot(self, message):
+        """Send a bot message now, or queue it for the next batch frame"""
+        await self.send_payloads([self.replay.append({'message': message, 'sender': 'bot'})])
+
+    async def send_payloads(self, payloads):
+        if self.batch_mode:
+            self.outbox.extend(payloads)
+        else:
+            for payload in payloads:
+                await self.send(**encode(payload, self.codec))
+
+    async def flush_soon(self):
+        """Send queued batch messages once the coalescing window has passed"""
+        if not self.outbox or self.outbox_task is not None:
+            return
+        window = getattr(settings, 'CHATBOT_COALESCE_WINDOW', 0.02)
+        if window <= 0:
+            await self.flush_outbox()
+        else:
+            self.outbox_task = asyncio.ensure_future(self.flush_later(window))
+
+    async def flush_later(self, window):
+        await asyncio.sleep(window)
+        self.outbox_task = None
+        await self.flush_outbox()
+
+    async def flush_outbox(self):
+        outbox, self.outbox = self.outbox, []
+        if outbox:
+            await self.send(**encode(outbox, self.codec))
+
+    async def bot_frames(self, event):
+        """Forward a group message that was encoded once by the sender"""
+        frame = event[self.codec]
+        if self.batch_mode:
+            await self.flush_outbox()
+            # Wrapping an encoded message in a one-element array needs no re-encoding
+            frame = b'\x91' + frame if self.codec == MSGPACK else f'[{frame}]'
+        if self.codec == MSGPACK:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def record(self, message, bot_response):
+        """Queue the exchange for write-behind persistence (customers only)"""
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            return
+
+        if self.chatbot_session_id is None:
+            self.chatbot_session_id = await database_sync_to_async(create_session)(user)
+        await transcript_buffer.add(self.chatbot_session_id, False, message)
+        await transcript_buffer.add(self.chatbot_session_id, True, bot_response)
+
+    async def order_status_reply(self, order_id):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            return "Please log in so I can look up your order."
+
+        order = await aget_order_status(order_id)
+        if order is None or order[0] != user.pk:
+            return f"I couldn't find order #{order_id} on your account. Please check the number."
+        return f"Order #{order_id} is currently {order[1]}."
 
     def get_bot_response(self, message):
-        # No changes in this method
         if not message:
-            return "I didn't catch that. Could you please repeat?"
-
-        message = message.lower()
-
-        if "roses" in message:
-            return "Yes, we have various colors of roses available. Would you like to see our collection?"
-        elif "delivery" in message:
-            return "We offer same-day delivery for orders placed before 2 PM, and next-day delivery for later orders."
-        elif "custom" in message:
-            return "You can create a custom bouquet by visiting our Custom Bouquets section or specifying your preferences here!"
-        elif "track" in message:
-            return "Please provide your order number, and I'll check its status for you."
+            return EMPTY_MESSAGE_REPLY
+
+        # Replies are computed from the normalised text, so every spelling
+        # that normalises the same way can share one cache entry
+        key = normalize(message)
+        generation = (self.rules, product_index.generation)
+        reply = reply_cache.get(generation, key)
+        if reply is MISSING:
+            reply = self.find_reply(key)
+            reply_cache.set(generation, key, reply)
+        return reply
+
+    def find_reply(self, message):
+        response = self.rules.matcher.match(message)
+        if response is None and getattr(settings, 'CHATBOT_RETRIEVAL_ENABLED', True):
+            response = self.rules.index.search(
+                message, getattr(settings, 'CHATBOT_RETRIEVAL_MIN_SCORE', 1.0),
+                getattr(settings, 'CHATBOT_RETRIEVAL_MIN_COVERAGE', 0.5))
+
+        # Product questions are answered from live inventory when possible;
+        # messages no rule answers only when they mostly name a product
+        if response is not None and response.category == 'product':
+            products = product_index.search(message)
+        elif response is None:
+            products = product_index.search(
+                message, name_coverage=getattr(settings, 'CHATBOT_PRODUCT_NAME_COVERAGE', 0.6))
         else:
-            return "Thank you for your message. How else can I assist you with your floral needs today?"
+            products = None
+        if products:
+            return product_reply(products)
+
+        if response is None:
+            response = self.rules.fallback
+        if response is None:
+            return DEFAULT_REPLY
+        return response.response_text
+
+
+class ChatRoomConsumer(AsyncWebsocketConsumer):
+    """
+    Live chat between the customer and the retailer of one ChatRoom.
+
+    Messages are fanned out to the room group encoded once and persisted
+    write-behind. Typing indicators are only relayed and read receipts only
+    lower the reader's unread counter, each at most once per
+    ``CHAT_ROOM_EVENT_INTERVAL`` seconds per socket.
+    """
+    FORBIDDEN_CLOSE_CODE = 4403
+    side = None
+
+    @property
+    def event_interval(self):
+        return getattr(settings, 'CHAT_ROOM_EVENT_INTERVAL', 1.0)
+
+    async def connect(self):
+        self.room_id = int(self.scope['url_route']['kwargs']['room_id'])
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated:
+            self.side = await database_sync_to_async(room_side)(self.room_id, user)
+        if self.side is None:
+            await self.close(code=self.FORBIDDEN_CLOSE_CODE)
+            return
+
+        self.username = user.username
+        self.room_group_name = f"chat_room_{self.room_id}"
+        self.typing_sent_at = None
+        self.read_until = None
+        self.read_task = None
+
+        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.side is None:
+            return
+        if self.read_task is not None:
+            self.read_task.cancel()
+        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        await room_buffer.flush()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data) if text_data is not None else None
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            await self.send(text_data=json.dumps({
+                'type': 'error', 'error': 'Frames must be JSON objects'}))
+            return
+
+        kind = data.get('type', 'message')
+        if kind == 'message':
+            await self.post_message(data.get('message'))
+        elif kind == 'typing':
+            await self.typing()
+        elif kind == 'read':
+            self.mark_read(data.get('timestamp'))
+        elif kind == 'history':
+            await self.send_history(data.get('before'), data.get('limit'))
+
+    async def post_message(self, content):
+        if not isinstance(content, str) or not content.strip():
+            return
+        max_length = getattr(settings, 'CHAT_MESSAGE_MAX_LENGTH', 2000)
+        if len(content) > max_length:
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'error': f'Messages are limited to {max_length} characters',
+            }))
+            return
+
+        timestamp = timezone.now()
+        await room_buffer.add(self.room_id, self.side, content, timestamp)
+        await self.fan_out({
+            'type': 'message',
+            'message': content,
+            'sender_type': self.side,
+            'username': self.username,
+            'timestamp': timestamp.isoformat(),
+        })
+
+    async def typing(self):
+        # Keystrokes within the interval are dropped, not queued
+        now = time.monotonic()
+        if self.typing_sent_at is not None and now - self.typing_sent_at < self.event_interval:
+            return
+        self.typing_sent_at = now
+        await self.fan_out({
+            'type': 'typing',
+            'sender_type': self.side,
+            'username': self.username,
+        }, skip_self=True)
+
+    def mark_read(self, timestamp):
+        """Remember the newest read position; the receipt goes out once per interval"""
+        now = timezone.now()
+        if timestamp is None:
+            timestamp = now
+        else:
+            try:
+                timestamp = parse_datetime(timestamp) if isinstance(timestamp, str) else None
+            except ValueError:
+                # Well formed but impossible, e.g. month 13
+                timestamp = None
+            if timestamp is None:
+                return
+            if timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp)
+            # Nothing after now can have been read
+            timestamp = min(timestamp, now)
+        if self.read_until is None or timestamp > self.read_until:
+            self.read_until = timestamp
+        if self.read_task is None:
+            self.read_task = asyncio.ensure_future(self.send_read_receipt())
+
+    async def send_read_receipt(self):
+        await asyncio.sleep(self.event_interval)
+        self.read_task = None
+        read_until = self.read_until
+        # Write out queued messages first so the count below sees them
+        await room_buffer.flush()
+        await database_sync_to_async(mark_room_read)(self.room_id, self.side, read_until)
+        await self.fan_out({
+            'type': 'read',
+            'sender_type': self.side,
+            'timestamp': read_until.isoformat(),
+        }, skip_self=True)
+
+    async def send_history(self, cursor, limit):
+        # Messages this worker hasn't written yet belong in the backlog too
+        await room_buffer.flush()
+        try:
+            limit = int(limit) if limit is not None else BACKLOG_PAGE_SIZE
+            messages, next_cursor = await database_sync_to_async(backlog_page)(
+                self.room_id, cursor, limit)
+        except (InvalidCursor, TypeError, ValueError):
+            await self.send(text_data=json.dumps({
+                'type': 'error', 'error': 'Invalid cursor or limit'}))
+            return
+        await self.send(text_data=json.dumps({
+            'type': 'history',
+            'messages': [serialize_message(message) for message in messages],
+            'next': next_cursor,
+        }))
+
+    async def fan_out(self, payload, skip_self=False):
+        """Send ``payload`` to the room, encoding it once for every socket"""
+        await self.channel_layer.group_send(self.room_group_name, {
+            'type': 'room.frame',
+            'text': json.dumps(payload),
+            'skip': self.channel_name if skip_self else None,
+        })
+
+    async def room_frame(self, event):
+        if event['skip'] != self.channel_name:
+            await self.send(text_data=event['text'])
+
@@ -0,0 +1,31 @@
+"""
+Opaque cursors for keyset pagination over ``(datetime, id)`` orderings.
+"""
+import base64
+import binascii
+
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(value, pk):
+    """Opaque cursor for the row at ``(value, pk)`` in a keyset ordering"""
+    raw = f"{value.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the ``(datetime, pk)`` a cursor points at"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        value, pk = raw.rsplit('|', 1)
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (AttributeError, binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if value is None:
+        raise InvalidCursor(cursor)
+    return value, pk
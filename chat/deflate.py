@@ -0,0 +1,54 @@
+"""
+permessage-deflate for daphne WebSockets.
+
+Daphne never offers WebSocket compression, so when
+``CHATBOT_WEBSOCKET_DEFLATE`` is on, ``install()`` swaps in an autobahn
+protocol that accepts the client's permessage-deflate offer. Frames shorter
+than ``CHATBOT_DEFLATE_MIN_BYTES`` are sent uncompressed; small chat replies
+are not worth the CPU, product-rich ones are.
+
+zlib's defaults cost a few hundred KB per socket for the compression and
+decompression state, so every socket is negotiated down to
+``CHATBOT_DEFLATE_WINDOW_BITS`` windows without context takeover in either
+direction, which keeps a socket's state to a few KB. Chat messages are
+compressed one by one anyway.
+"""
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne import ws_protocol
+from django.conf import settings
+
+
+def accept_deflate(offers):
+    window_bits = getattr(settings, 'CHATBOT_DEFLATE_WINDOW_BITS', 10)
+    for offer in offers:
+        if not isinstance(offer, PerMessageDeflateOffer):
+            continue
+        if offer.request_max_window_bits:
+            window_bits = min(window_bits, offer.request_max_window_bits)
+        return PerMessageDeflateOfferAccept(
+            offer,
+            # Client-to-server: only when the client can honour the request
+            request_no_context_takeover=offer.accept_no_context_takeover,
+            request_max_window_bits=window_bits if offer.accept_max_window_bits else 0,
+            # Server-to-client
+            no_context_takeover=True,
+            window_bits=window_bits,
+            mem_level=getattr(settings, 'CHATBOT_DEFLATE_MEM_LEVEL', 4),
+        )
+    return None
+
+
+class DeflateWebSocketProtocol(ws_protocol.WebSocketProtocol):
+    # Autobahn copies factory options onto the protocol unless already set
+    perMessageCompressionAccept = staticmethod(accept_deflate)
+
+    def sendMessage(self, payload, isBinary=False, fragmentSize=None, sync=False,
+                    doNotCompress=False):
+        if len(payload) < getattr(settings, 'CHATBOT_DEFLATE_MIN_BYTES', 512):
+            doNotCompress = True
+        super().sendMessage(payload, isBinary, fragmentSize, sync, doNotCompress)
+
+
+def install():
+    """Make daphne's WebSocket factory build compressing protocols"""
+    ws_protocol.WebSocketFactory.protocol = DeflateWebSocketProtocol
@@ -0,0 +1,64 @@
+"""
+Keyset pagination over a customer's chatbot sessions.
+
+Pages are ordered newest first on ``(created_at, id)`` and continue from an
+opaque cursor instead of an OFFSET, so every page costs the same no matter
+how deep the customer scrolls. Each session carries a short preview of its
+latest messages, fetched for the whole page in a single query, or read from
+the archive for sessions whose messages were moved to cold storage.
+"""
+from django.db.models import Prefetch, Q
+
+from .archive import archived_messages
+from .cursors import InvalidCursor, decode_cursor, encode_cursor  # noqa: F401
+from .models import ChatbotMessage, ChatbotSession
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+PREVIEW_MESSAGES = 3
+
+
+def history_page(customer, cursor=None, limit=PAGE_SIZE):
+    """Return ``(sessions, next_cursor)`` for one page of a customer's history"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    previews = ChatbotMessage.objects.order_by('-timestamp', '-id')[:PREVIEW_MESSAGES]
+    sessions = ChatbotSession.objects.filter(customer=customer).order_by(
+        '-created_at', '-id'
+    ).prefetch_related(Prefetch('messages', queryset=previews, to_attr='preview'))
+
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        sessions = sessions.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+
+    # Fetch one extra row to know whether another page exists
+    page = list(sessions[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        next_cursor = encode_cursor(page[limit - 1].created_at, page[limit - 1].pk)
+    page = page[:limit]
+
+    # Sessions without live messages may have been moved to cold storage
+    restored = archived_messages('chatbot', [s.pk for s in page if not s.preview])
+    for session in page:
+        if session.pk in restored:
+            session.preview = restored[session.pk][::-1][:PREVIEW_MESSAGES]
+    return page, next_cursor
+
+
+def serialize_session(session):
+    return {
+        'id': session.pk,
+        'created_at': session.created_at.isoformat(),
+        'last_activity': session.last_activity.isoformat(),
+        'is_active': session.is_active,
+        'messages': [
+            {
+                'is_bot': message.is_bot,
+                'content': message.content,
+                'timestamp': message.timestamp.isoformat(),
+            }
+            # The preview is fetched newest first; show it in reading order
+            for message in reversed(session.preview)
+        ],
+    }
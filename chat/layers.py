@@ -0,0 +1,220 @@
+"""
+Channel layer that lets several daphne processes on one host share groups.
+
+Every worker connects to the ``run_channel_broker`` process over a Unix
+domain socket (see ``chat.broker``), which owns all channel queues and
+groups. Enable it with::
+
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.UnixSocketChannelLayer',
+            'CONFIG': {'path': '/run/floracouture/channels.sock'},
+        }
+    }
+"""
+import asyncio
+import itertools
+import random
+import string
+import weakref
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .broker import DEFAULT_SOCKET_PATH
+
+
+class _Connection:
+    """One broker connection, owned by a single event loop"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.ids = itertools.count(1)
+        # request id -> (future, channel for receives)
+        self.pending = {}
+        # Messages that arrived for a receive() that was cancelled meanwhile
+        self.stashed = {}
+        self.listener = asyncio.ensure_future(self._listen())
+
+    def request(self, op, *args, channel=None):
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = (future, channel)
+        self.write(op, request_id, *args)
+        return request_id, future
+
+    def write(self, *frame):
+        self.writer.write(msgpack.packb(frame, use_bin_type=True))
+
+    @property
+    def closed(self):
+        return self.listener.done()
+
+    async def _listen(self):
+        unpacker = msgpack.Unpacker(raw=False)
+        error = ConnectionError('Lost connection to the channel broker')
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                unpacker.feed(data)
+                for status, request_id, value in unpacker:
+                    future, channel = self.pending.pop(request_id, (None, None))
+                    if future is None:
+                        continue
+                    if future.cancelled():
+                        if channel is not None and status == 'ok':
+                            self.stashed.setdefault(channel, []).append(value)
+                    elif status == 'full':
+                        future.set_exception(ChannelFull(value))
+                    else:
+                        future.set_result(value)
+        except Exception as exc:
+            error = exc
+        finally:
+            for future, _ in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+            self.writer.close()
+
+    async def close(self):
+        self.writer.close()
+        await asyncio.gather(self.listener, return_exceptions=True)
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    """
+    Channel layer backed by a broker on a Unix domain socket.
+
+    ``channel_capacity`` keys must be glob strings because the config is
+    shipped to the broker, which enforces capacity and expiry.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=DEFAULT_SOCKET_PATH, expiry=60, group_expiry=86400,
+                 capacity=100, channel_capacity=None, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity,
+                         channel_capacity=channel_capacity, **kwargs)
+        self.path = path
+        self.group_expiry = group_expiry
+        self._channel_capacity = dict(channel_capacity or {})
+        self.channel_capacity = self.compile_capacities(self._channel_capacity)
+        # async_to_sync runs each call in its own loop; streams can't be shared.
+        # The connections refer to their loops, so weak keys would never be
+        # dropped: entries are removed when their loop closes instead.
+        self._connections = {}
+        self._connecting = {}
+
+    def _forget_on_close(self, loop):
+        """Close and drop ``loop``'s connection when the loop is closed"""
+        layer = weakref.ref(self)
+        close = loop.close
+
+        def closing(*args, **kwargs):
+            loop.close = close
+            this = layer()
+            if this is not None:
+                this._connecting.pop(loop, None)
+                connection = this._connections.pop(loop, None)
+                if connection is not None and not loop.is_running() and not loop.is_closed():
+                    loop.run_until_complete(connection.close())
+            return close(*args, **kwargs)
+
+        loop.close = closing
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is not None and not connection.closed:
+            return connection
+        # Coroutines that arrive while the first one connects wait for its connection
+        lock = self._connecting.get(loop)
+        if lock is None:
+            lock = self._connecting[loop] = asyncio.Lock()
+            self._forget_on_close(loop)
+        async with lock:
+            connection = self._connections.get(loop)
+            if connection is None or connection.closed:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+                connection = _Connection(reader, writer)
+                _, future = connection.request(
+                    'hello', self.capacity, list(self._channel_capacity.items()), self.expiry)
+                await future
+                self._connections[loop] = connection
+        return connection
+
+    @staticmethod
+    def _pack(message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert '__asgi_channel__' not in message
+        return msgpack.packb(message, use_bin_type=True)
+
+    async def send(self, channel, message):
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        body = self._pack(message)
+        connection = await self._connection()
+        _, future = connection.request('send', channel, body)
+        await future
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        connection = await self._connection()
+        stashed = connection.stashed.get(channel)
+        if stashed:
+            body = stashed.pop(0)
+            if not stashed:
+                del connection.stashed[channel]
+        else:
+            request_id, future = connection.request('receive', channel, channel=channel)
+            try:
+                body = await future
+            except asyncio.CancelledError:
+                # If the broker already answered, the listener stashes the
+                # message for the next receive() instead of losing it
+                if not connection.closed:
+                    connection.write('cancel', request_id)
+                raise
+        return msgpack.unpackb(body, raw=False)
+
+    async def new_channel(self, prefix='specific.'):
+        return '%s.unix!%s' % (
+            prefix,
+            ''.join(random.choice(string.ascii_letters) for _ in range(12)),
+        )
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        connection = await self._connection()
+        _, future = connection.request('group_add', group, channel, self.group_expiry)
+        await future
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        connection = await self._connection()
+        _, future = connection.request('group_discard', group, channel)
+        await future
+
+    async def group_send(self, group, message):
+        """Send to every channel in ``group``; returns how many accepted it"""
+        assert self.valid_group_name(group), 'Group name not valid'
+        body = self._pack(message)
+        connection = await self._connection()
+        _, future = connection.request('group_send', group, body)
+        return await future
+
+    async def flush(self):
+        connection = await self._connection()
+        _, future = connection.request('flush')
+        await future
+
+    async def close(self):
+        connection = self._connections.pop(asyncio.get_running_loop(), None)
+        if connection is not None:
+            await connection.close()
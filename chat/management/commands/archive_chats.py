@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import ARCHIVED_KINDS, archive_source, idle_sources
+
+
+class Command(BaseCommand):
+    help = 'Moves messages of idle chat sessions and rooms into compressed cold storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90,
+                            help='Archive sources with no messages in this many days')
+        parser.add_argument('--kind', choices=sorted(ARCHIVED_KINDS), action='append',
+                            help='Only archive this kind (repeatable, default: all)')
+        parser.add_argument('--chunk', type=int, default=500,
+                            help='Sessions or rooms archived per pass')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Hot rows deleted per DELETE statement')
+        parser.add_argument('--max-chunks', type=int, default=None,
+                            help='Stop after this many passes per kind')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        for kind in options['kind'] or sorted(ARCHIVED_KINDS):
+            sources = messages = passes = after = 0
+            while options['max_chunks'] is None or passes < options['max_chunks']:
+                ids = idle_sources(kind, cutoff, options['chunk'], after)
+                if not ids:
+                    break
+                after = ids[-1]
+                for source_id in ids:
+                    messages += archive_source(kind, source_id, options['batch_size'])
+                sources += len(ids)
+                passes += 1
+
+            self.stdout.write(self.style.SUCCESS(
+                f'Archived {messages} {kind} messages from {sources} sources'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.broadcast import LOCAL_LAYER_ERROR, layer_is_local, send_broadcast, shard_count
+from chat.models import Broadcast
+
+
+class Command(BaseCommand):
+    help = 'Pushes a message to every connected chatbot socket'
+
+    def add_arguments(self, parser):
+        parser.add_argument('message', help='Text of the announcement')
+
+    def handle(self, *args, **options):
+        message = options['message'].strip()
+        if not message:
+            raise CommandError('The message is empty')
+        if layer_is_local():
+            # Its groups live in this process, which holds no sockets
+            raise CommandError(LOCAL_LAYER_ERROR)
+
+        broadcast = Broadcast.objects.create(message=message)
+        delivered = send_broadcast(broadcast)
+        count = 'an unknown number of' if delivered is None else delivered
+        self.stdout.write(self.style.SUCCESS(
+            f'Broadcast {broadcast.pk} delivered to {count} sockets '
+            f'across {shard_count()} groups'))
@@ -0,0 +1,115 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from chat.broker import Broker
+from chat.layers import UnixSocketChannelLayer
+
+
+def run_broker(path):
+    asyncio.run(Broker(path).serve_forever())
+
+
+async def point_to_point(layer, count):
+    """Messages per second through one channel with a concurrent reader"""
+    channel = await layer.new_channel()
+    message = {'type': 'chat.message', 'message': 'Do you have roses available?'}
+
+    async def produce():
+        for _ in range(count):
+            await layer.send(channel, message)
+
+    async def consume():
+        for _ in range(count):
+            await layer.receive(channel)
+
+    started = time.perf_counter()
+    await asyncio.gather(produce(), consume())
+    return count / (time.perf_counter() - started)
+
+
+async def fan_out(layer, members, count):
+    """Deliveries per second from group_send to ``members`` readers"""
+    group = 'benchmark'
+    channels = [await layer.new_channel() for _ in range(members)]
+    for channel in channels:
+        await layer.group_add(group, channel)
+    message = {'type': 'chat.message', 'message': 'Spring collection is live!'}
+
+    async def produce():
+        for _ in range(count):
+            await layer.group_send(group, message)
+
+    async def consume(channel):
+        for _ in range(count):
+            await layer.receive(channel)
+
+    started = time.perf_counter()
+    await asyncio.gather(produce(), *(consume(channel) for channel in channels))
+    elapsed = time.perf_counter() - started
+    for channel in channels:
+        await layer.group_discard(group, channel)
+    return members * count / elapsed
+
+
+class Command(BaseCommand):
+    help = 'Compares channel layer throughput for the in-memory, Unix socket and Redis backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=5000,
+                            help='Messages sent through a single channel')
+        parser.add_argument('--group-size', type=int, default=50,
+                            help='Channels in the fan-out group')
+        parser.add_argument('--group-messages', type=int, default=200,
+                            help='Messages sent to the fan-out group')
+        parser.add_argument('--redis', default='redis://127.0.0.1:6379',
+                            help='redis-server for channels_redis (skipped if unreachable)')
+
+    def handle(self, *args, **options):
+        capacity = max(options['messages'], options['group_messages'])
+        self.stdout.write(f"{'backend':<12} {'send/receive msg/s':>20} {'fan-out deliveries/s':>22}")
+
+        self.report('in-memory', InMemoryChannelLayer(capacity=capacity), options)
+
+        path = os.path.join(tempfile.mkdtemp(), 'channels.sock')
+        broker = multiprocessing.Process(target=run_broker, args=(path,), daemon=True)
+        broker.start()
+        try:
+            for _ in range(50):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.1)
+            self.report('unix-socket', UnixSocketChannelLayer(path, capacity=capacity), options)
+        finally:
+            broker.terminate()
+            broker.join()
+
+        try:
+            from channels_redis.core import RedisChannelLayer
+        except ImportError:
+            self.stdout.write('redis        skipped: channels_redis is not installed')
+            return
+        layer = RedisChannelLayer(hosts=[options['redis']], capacity=capacity)
+        self.report('redis', layer, options)
+
+    def report(self, name, layer, options):
+        async def run():
+            try:
+                single = await point_to_point(layer, options['messages'])
+                group = await fan_out(layer, options['group_size'], options['group_messages'])
+            finally:
+                if hasattr(layer, 'close'):
+                    await layer.close()
+            return single, group
+
+        try:
+            single, group = asyncio.run(run())
+        except (ConnectionError, OSError) as exc:
+            self.stdout.write(f'{name:<12} skipped: {exc}')
+            return
+        self.stdout.write(f'{name:<12} {single:>20,.0f} {group:>22,.0f}')
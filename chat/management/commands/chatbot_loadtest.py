@@ -0,0 +1,293 @@
+import asyncio
+import base64
+import itertools
+import json
+import math
+import os
+import resource
+import struct
+import sys
+import time
+from urllib.parse import urlparse
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from chat.routing import websocket_urlpatterns
+from chat.throttle import throttle
+
+DEFAULT_CORPUS = [
+    'Hello',
+    'Do you have roses available?',
+    'What are your delivery options?',
+    'How can I create a custom bouquet?',
+    'Track my order',
+    'Thanks, bye!',
+]
+
+
+def load_corpus(path):
+    """
+    Read chat messages from a text or JSONL file.
+
+    JSON objects contribute their ``message`` field, falling back to
+    ``title`` or ``body``; anything that is not JSON is used as-is.
+    """
+    messages = []
+    with open(path, encoding='utf-8') as corpus:
+        for line in corpus:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                messages.append(line)
+                continue
+            if isinstance(record, dict):
+                record = record.get('message') or record.get('title') or record.get('body')
+            if isinstance(record, str) and record:
+                messages.append(record)
+    return messages
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(values)) - 1, 0)
+    return values[rank]
+
+
+def peak_rss_mb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return usage / (1024 * 1024)
+    return usage / 1024
+
+
+def process_peak_rss_mb(pid):
+    """Peak RSS of another local process, from /proc (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/status', encoding='ascii') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError as exc:
+        raise CommandError(f'Cannot read the memory of process {pid}: {exc}')
+    raise CommandError(f'Process {pid} reports no peak RSS')
+
+
+class RemoteClient:
+    """
+    Minimal RFC 6455 client for a running daphne, shaped like WebsocketCommunicator.
+
+    Autobahn cannot be used here because daphne already pins txaio to Twisted
+    inside manage.py, so the handshake and framing are done on asyncio streams.
+    """
+
+    def __init__(self, url):
+        self.url = urlparse(url)
+        self.reader = None
+        self.writer = None
+
+    async def connect(self, timeout=10):
+        secure = self.url.scheme == 'wss'
+        host = self.url.hostname
+        port = self.url.port or (443 if secure else 80)
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=secure or None), timeout)
+
+        key = base64.b64encode(os.urandom(16)).decode('ascii')
+        self.writer.write((
+            f"GET {self.url.path or '/'} HTTP/1.1\r\n"
+            f"Host: {self.url.netloc}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n\r\n"
+        ).encode('ascii'))
+        headers = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+        status = headers.split(b'\r\n', 1)[0].split()
+        return len(status) > 1 and status[1] == b'101', None
+
+    def _write_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        mask = os.urandom(4)
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.writer.write(header + mask + masked)
+
+    async def _read_frame(self):
+        first, second = await self.reader.readexactly(2)
+        length = second & 0x7F
+        if length == 126:
+            length, = struct.unpack('!H', await self.reader.readexactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', await self.reader.readexactly(8))
+        mask = await self.reader.readexactly(4) if second & 0x80 else None
+        payload = await self.reader.readexactly(length)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return bool(first & 0x80), first & 0x0F, payload
+
+    async def send_json_to(self, data):
+        self._write_frame(0x1, json.dumps(data).encode('utf-8'))
+        await self.writer.drain()
+
+    async def receive_json_from(self, timeout=10):
+        return json.loads(await asyncio.wait_for(self._receive_message(), timeout))
+
+    async def _receive_message(self):
+        chunks = []
+        while True:
+            fin, opcode, payload = await self._read_frame()
+            if opcode == 0x8:
+                raise ConnectionError('connection closed by server')
+            if opcode == 0x9:
+                self._write_frame(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            chunks.append(payload)
+            if fin:
+                return b''.join(chunks)
+
+    async def disconnect(self):
+        if self.writer is None:
+            return
+        try:
+            self._write_frame(0x8, struct.pack('!H', 1000))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+class Command(BaseCommand):
+    help = 'Simulates concurrent chatbot clients and reports latency and throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10,
+                            help='Number of concurrent WebSocket clients')
+        parser.add_argument('--messages', type=int, default=None,
+                            help='Messages sent by each client (default: corpus size)')
+        parser.add_argument('--corpus',
+                            help='Text or JSONL file of messages to replay')
+        parser.add_argument('--url',
+                            help='Base URL of a running daphne, e.g. ws://127.0.0.1:8000. '
+                                 'Without it clients run in-process.')
+        parser.add_argument('--server-pid', type=int,
+                            help='PID of the daphne serving --url, to report its peak RSS')
+        parser.add_argument('--timeout', type=float, default=10,
+                            help='Seconds to wait for each reply')
+        parser.add_argument('--throttle', action='store_true',
+                            help='Keep the chatbot rate limits on for in-process runs '
+                                 '(remote servers always apply their own)')
+
+    def handle(self, *args, **options):
+        corpus = load_corpus(options['corpus']) if options['corpus'] else DEFAULT_CORPUS
+        if not corpus:
+            raise CommandError('The corpus contains no messages')
+        if options['clients'] < 1:
+            raise CommandError('--clients must be at least 1')
+
+        per_client = options['messages'] or len(corpus)
+        if options['url'] and not options['throttle']:
+            # Remote servers apply their own CHATBOT_* rate limits, which a
+            # client sending as fast as replies arrive soon exceeds
+            self.stderr.write(self.style.WARNING(
+                'The server rate limits every connection (CHATBOT_RATE_BURST frames, '
+                'then CHATBOT_RATE_LIMIT per second); throttled frames get no reply and '
+                'count as errors. Start the server with CHATBOT_RATE_LIMIT = 0 and '
+                'CHATBOT_SESSION_RATE_LIMIT = 0 to measure it unthrottled, or pass '
+                '--throttle to silence this warning.'))
+        if options['url'] or options['throttle']:
+            stats = asyncio.run(self.run(options, corpus, per_client))
+        else:
+            # Clients send as fast as replies come back, which the rate
+            # limits are designed to stop
+            with override_settings(CHATBOT_RATE_LIMIT=0, CHATBOT_SESSION_RATE_LIMIT=0):
+                stats = asyncio.run(self.run(options, corpus, per_client))
+        self.report(options, stats)
+
+    def make_client(self, url, path):
+        if url:
+            return RemoteClient(url.rstrip('/') + path)
+        return WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+
+    async def run(self, options, corpus, per_client):
+        stats = {'connect': [], 'reply': [], 'errors': 0}
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            self.run_client(index, options, corpus, per_client, stats)
+            for index in range(options['clients'])
+        ))
+        stats['elapsed'] = time.perf_counter() - started
+        return stats
+
+    async def run_client(self, index, options, corpus, per_client, stats):
+        timeout = options['timeout']
+        client = self.make_client(options['url'], f'/ws/chatbot/loadtest-{index}/')
+        # Clients start at different points of the corpus
+        messages = itertools.islice(itertools.cycle(corpus), index, index + per_client)
+
+        try:
+            started = time.perf_counter()
+            connected, _ = await client.connect(timeout=timeout)
+            if not connected:
+                stats['errors'] += 1
+                return
+            await client.receive_json_from(timeout=timeout)  # welcome message
+            stats['connect'].append(time.perf_counter() - started)
+
+            for message in messages:
+                sent = time.perf_counter()
+                await client.send_json_to({'message': message})
+                await client.receive_json_from(timeout=timeout)
+                stats['reply'].append(time.perf_counter() - sent)
+        except (asyncio.TimeoutError, OSError, ValueError) as exc:
+            stats['errors'] += 1
+            self.stderr.write(f'Client {index} failed: {exc!r}')
+        finally:
+            await client.disconnect()
+
+    def report(self, options, stats):
+        connect = sorted(stats['connect'])
+        reply = sorted(stats['reply'])
+        mode = options['url'] or 'in-process'
+
+        self.stdout.write(f"Target:          {mode}")
+        self.stdout.write(f"Clients:         {options['clients']} "
+                          f"({len(connect)} connected, {stats['errors']} errors)")
+        self.stdout.write(f"Messages:        {len(reply)} in {stats['elapsed']:.2f}s")
+        for label, values in (('Connect latency', connect), ('Reply latency', reply)):
+            self.stdout.write(
+                f"{label + ':':<17}"
+                f"p50 {percentile(values, 50) * 1000:.2f} ms  "
+                f"p95 {percentile(values, 95) * 1000:.2f} ms  "
+                f"p99 {percentile(values, 99) * 1000:.2f} ms")
+        throughput = len(reply) / stats['elapsed'] if stats['elapsed'] else 0.0
+        self.stdout.write(f"Throughput:      {throughput:.1f} messages/sec")
+        if not options['url']:
+            self.stdout.write(f"Peak RSS:        {peak_rss_mb():.1f} MB")
+        else:
+            if options['server_pid']:
+                self.stdout.write(
+                    f"Server peak RSS: {process_peak_rss_mb(options['server_pid']):.1f} MB")
+            self.stdout.write(f"Client peak RSS: {peak_rss_mb():.1f} MB")
+        if not options['url']:
+            self.stdout.write(f"Throttled:       {throttle.throttled} frames")
+
+        if stats['errors']:
+            self.stdout.write(self.style.WARNING(f"{stats['errors']} clients failed"))
+        else:
+            self.stdout.write(self.style.SUCCESS('Load test completed'))
@@ -0,0 +1,25 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.broker import DEFAULT_SOCKET_PATH, Broker, BrokerRunning
+
+
+class Command(BaseCommand):
+    help = 'Runs the broker that UnixSocketChannelLayer workers on this host connect to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None,
+                            help='Unix socket path (default: the layer CONFIG path)')
+
+    def handle(self, *args, **options):
+        config = settings.CHANNEL_LAYERS.get('default', {}).get('CONFIG', {})
+        path = options['path'] or config.get('path', DEFAULT_SOCKET_PATH)
+        self.stdout.write(f'Channel broker listening on {path}')
+        try:
+            asyncio.run(Broker(path).serve_forever())
+        except KeyboardInterrupt:
+            pass
+        except BrokerRunning as exc:
+            raise CommandError(str(exc))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from chat.models import BotResponse
+from chat.rules import bump_rules_version
 
 
 class Command(BaseCommand):
@@ -77,5 +78,8 @@ class Command(BaseCommand):
         for response_data in responses:
             BotResponse.objects.create(**response_data)
 
+        # Make every running worker reload the new rule set
+        bump_rules_version()
+
         self.stdout.write(self.style.SUCCESS(
             f'Successfully created {len(responses)} chatbot responses'))
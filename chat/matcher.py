@@ -0,0 +1,107 @@
+"""
+Keyword matching for chatbot replies.
+
+Every ``BotResponse.keywords`` list is compiled into a single Aho-Corasick
+automaton, so a message is scanned once no matter how many rules exist.
+"""
+import re
+from collections import deque
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Case-fold ``text`` and collapse punctuation and whitespace to single spaces."""
+    return ' '.join(WORD_RE.findall(text.casefold()))
+
+
+def split_keywords(keywords):
+    """Return the normalised, non-empty entries of a comma-separated string."""
+    return [k for k in (normalize(k) for k in keywords.split(',')) if k]
+
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over the keywords of a list of responses.
+
+    Responses only need ``keywords`` and ``priority`` attributes. A keyword
+    only counts when it matches whole words, so "hi" does not fire on "ship".
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self._priorities = [r.priority for r in self.responses]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+
+        for index, response in enumerate(self.responses):
+            for keyword in split_keywords(response.keywords):
+                self._add(keyword, index)
+        self._link()
+
+    def __len__(self):
+        return len(self.responses)
+
+    def _add(self, keyword, index):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = next_state
+        self._out[state] += ((len(keyword), index),)
+
+    def _link(self):
+        # Breadth-first pass setting failure links and merging the outputs
+        # of each state's longest proper suffix into its own.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._out[next_state] += self._out[fail]
+
+    def match(self, message):
+        """
+        Return the best response triggered by ``message``, or None.
+
+        Ties are resolved by highest priority, then longest keyword, then
+        the earliest response in the list.
+        """
+        text = message.casefold()
+        size = len(text)
+        goto, fail, out = self._goto, self._fail, self._out
+        best = None
+        state = 0
+
+        for end, char in enumerate(text, 1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, index in out[state]:
+                start = end - length
+                if start and _is_word_char(text[start - 1]):
+                    continue
+                if end < size and _is_word_char(text[end]):
+                    continue
+                key = (self._priorities[index], length, -index)
+                if best is None or key > best:
+                    best = key
+
+        if best is None:
+            return None
+        return self.responses[-best[2]]
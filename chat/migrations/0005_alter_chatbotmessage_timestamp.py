@@ -0,0 +1,19 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:03
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_botresponseversion"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="chatbotmessage",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0005_alter_chatbotmessage_timestamp"),
+        ("customers", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="chatbotsession",
+            index=models.Index(
+                fields=["customer", "created_at", "id"],
+                name="chat_session_customer_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="chatbotmessage",
+            index=models.Index(
+                fields=["session", "timestamp"], name="chat_message_session_idx"
+            ),
+        ),
+    ]
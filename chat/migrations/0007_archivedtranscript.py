@@ -0,0 +1,51 @@
+# Generated by Django 5.1.7 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0006_chatbotsession_chatbotmessage_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedTranscript",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("chatbot", "Chatbot session"),
+                            ("chat", "Chat session"),
+                            ("room", "Chat room"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("source_id", models.PositiveBigIntegerField()),
+                ("message_count", models.PositiveIntegerField()),
+                ("first_timestamp", models.DateTimeField()),
+                ("last_timestamp", models.DateTimeField()),
+                ("payload", models.BinaryField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["kind", "source_id"], name="chat_archive_source_idx"
+                    )
+                ],
+            },
+        ),
+    ]
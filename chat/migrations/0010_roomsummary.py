@@ -0,0 +1,96 @@
+# Generated by Django 5.1.7 on 2026-10-18 17:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_summaries(apps, schema_editor):
+    ChatRoom = apps.get_model("chat", "ChatRoom")
+    Message = apps.get_model("chat", "Message")
+    RoomSummary = apps.get_model("chat", "RoomSummary")
+
+    summaries = []
+    for room in ChatRoom.objects.iterator():
+        last = (
+            Message.objects.filter(room_id=room.pk).order_by("-timestamp", "-id").first()
+        )
+        summaries.append(
+            RoomSummary(
+                room_id=room.pk,
+                customer_id=room.customer_id,
+                retailer_id=room.retailer_id,
+                last_message=last.content[:200] if last else "",
+                last_sender_type=last.sender_type if last else "",
+                last_timestamp=last.timestamp if last else room.created_at,
+                # Read state was never recorded, so history starts out read
+                customer_unread=0,
+                retailer_unread=0,
+            )
+        )
+        if len(summaries) >= 500:
+            RoomSummary.objects.bulk_create(summaries)
+            summaries = []
+    RoomSummary.objects.bulk_create(summaries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0009_alter_message_timestamp_and_more"),
+        ("customers", "0001_initial"),
+        ("retailers", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RoomSummary",
+            fields=[
+                (
+                    "room",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="chat.chatroom",
+                    ),
+                ),
+                ("last_message", models.CharField(blank=True, max_length=200)),
+                ("last_sender_type", models.CharField(blank=True, max_length=10)),
+                ("last_timestamp", models.DateTimeField()),
+                ("customer_unread", models.PositiveIntegerField(default=0)),
+                ("retailer_unread", models.PositiveIntegerField(default=0)),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="customers.customer",
+                    ),
+                ),
+                (
+                    "retailer",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="retailers.retailer",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["customer", "last_timestamp", "room"],
+                        name="chat_inbox_customer_idx",
+                    ),
+                    models.Index(
+                        fields=["retailer", "last_timestamp", "room"],
+                        name="chat_inbox_retailer_idx",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# (index name, model, column); FULLTEXT indexes only exist on MySQL, other
+# backends search through chat.search's in-process index instead
+FULLTEXT_INDEXES = [
+    ("chat_chatbotmessage_ft", "chatbotmessage", "content"),
+    ("chat_chatmessage_ft", "chatmessage", "message"),
+    ("chat_message_ft", "message", "content"),
+]
+
+
+def add_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    quote = schema_editor.quote_name
+    for name, model_name, column in FULLTEXT_INDEXES:
+        table = apps.get_model("chat", model_name)._meta.db_table
+        schema_editor.execute(
+            f"CREATE FULLTEXT INDEX {quote(name)} ON {quote(table)} ({quote(column)})"
+        )
+
+
+def drop_fulltext_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    quote = schema_editor.quote_name
+    for name, model_name, _ in FULLTEXT_INDEXES:
+        table = apps.get_model("chat", model_name)._meta.db_table
+        schema_editor.execute(f"DROP INDEX {quote(name)} ON {quote(table)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0010_roomsummary"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_fulltext_indexes, drop_fulltext_indexes),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 12:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Retailers chat as users: ``chatroom.retailer`` has pointed at the user
+    table since 0002, so this only brings the model state in line with it.
+    The summary's copy has no database constraint and follows suit.
+    """
+
+    dependencies = [
+        ('chat', '0011_message_fulltext_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatroom',
+            name='retailer',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retailer_rooms', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='roomsummary',
+            name='retailer',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -1,11 +1,14 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
 
 
 class ChatRoom(models.Model):
+    # Retailers sign in as users, like the owners of their products
     retailer = models.ForeignKey(
-        'retailers.Retailer', on_delete=models.CASCADE)
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='retailer_rooms')
     customer = models.ForeignKey(
         'customers.Customer', on_delete=models.CASCADE)
     product = models.ForeignKey(
@@ -22,7 +25,50 @@ class Message(models.Model):
     sender_type = models.CharField(max_length=10, choices=[(
         'customer', 'Customer'), ('retailer', 'Retailer')])
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is sent, not when the write-behind buffer flushes it
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a room's backlog
+            models.Index(fields=['room', 'timestamp', 'id'],
+                         name='chat_room_message_idx'),
+        ]
+
+
+class RoomSummary(models.Model):
+    """
+    Inbox row for a ChatRoom, kept up to date with every batch of messages.
+
+    ``customer`` and ``retailer`` are copied from the room so an inbox is one
+    indexed query; the room's own foreign keys enforce their integrity.
+    """
+    room = models.OneToOneField(
+        ChatRoom, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    customer = models.ForeignKey(
+        'customers.Customer', on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name='+')
+    retailer = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False,
+        related_name='+')
+    last_message = models.CharField(max_length=200, blank=True)
+    last_sender_type = models.CharField(max_length=10, blank=True)
+    # The room's creation time until the first message arrives
+    last_timestamp = models.DateTimeField()
+    # Messages each side has not read yet
+    customer_unread = models.PositiveIntegerField(default=0)
+    retailer_unread = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'last_timestamp', 'room'],
+                         name='chat_inbox_customer_idx'),
+            models.Index(fields=['retailer', 'last_timestamp', 'room'],
+                         name='chat_inbox_retailer_idx'),
+        ]
+
+    def __str__(self):
+        return f"Summary of room {self.room_id}"
 
 
 class ChatbotSession(models.Model):
@@ -32,6 +78,13 @@ class ChatbotSession(models.Model):
     last_activity = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination of a customer's history
+            models.Index(fields=['customer', 'created_at', 'id'],
+                         name='chat_session_customer_idx'),
+        ]
+
     def __str__(self):
         return f"Chatbot session for {self.customer.username} ({self.created_at})"
 
@@ -42,10 +95,16 @@ class ChatbotMessage(models.Model):
     # False for customer, True for bot
     is_bot = models.BooleanField(default=False)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message is queued, not when the write-behind buffer flushes it
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Latest-message previews per session
+            models.Index(fields=['session', 'timestamp'],
+                         name='chat_message_session_idx'),
+        ]
 
     def __str__(self):
         sender = "Bot" if self.is_bot else "Customer"
@@ -77,6 +136,26 @@ class BotResponse(models.Model):
         return f"{self.category}: {self.response_text[:30]}..."
 
 
+class BotResponseVersion(models.Model):
+    """Version stamp of the BotResponse rule set, bumped on every change"""
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        updated = cls.objects.filter(pk=1).update(
+            version=models.F('version') + 1, updated_at=timezone.now())
+        if not updated:
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    def __str__(self):
+        return f"Bot responses v{self.version}"
+
+
 class ChatSession(models.Model):
     session_id = models.CharField(max_length=100)
     user = models.ForeignKey('customers.Customer',
@@ -97,3 +176,43 @@ class ChatMessage(models.Model):
     def __str__(self):
         sender = "Bot" if self.is_bot else "User"
         return f"{sender}: {self.message[:30]}"
+
+
+class ArchivedTranscript(models.Model):
+    """Messages of an idle session or room, compressed out of the hot tables"""
+    KIND_CHOICES = [
+        ('chatbot', 'Chatbot session'),
+        ('chat', 'Chat session'),
+        ('room', 'Chat room'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    # Primary key of the ChatbotSession, ChatSession or ChatRoom
+    source_id = models.PositiveBigIntegerField()
+    message_count = models.PositiveIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    # zlib-compressed msgpack list of message rows
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'source_id'],
+                         name='chat_archive_source_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.source_id} ({self.message_count} messages)"
+
+
+class Broadcast(models.Model):
+    """An announcement pushed to every connected chatbot socket"""
+    message = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Sockets the channel layer accepted it for; null if the layer can't tell
+    delivered = models.PositiveIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Broadcast: {self.message[:30]}"
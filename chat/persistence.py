@@ -0,0 +1,182 @@
+"""
+Write-behind persistence of chat messages.
+
+ChatbotConsumer queues messages here instead of inserting them one by one.
+The buffer writes them with a single ``bulk_create`` once
+``CHATBOT_TRANSCRIPT_BATCH_SIZE`` messages are pending, after
+``CHATBOT_TRANSCRIPT_FLUSH_INTERVAL`` seconds, when a socket disconnects and
+when the worker exits. At most ``CHATBOT_TRANSCRIPT_MAX_PENDING`` messages
+are held; past that, callers wait for a flush before queueing more.
+"""
+import asyncio
+import atexit
+import logging
+import threading
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+def create_session(customer):
+    """Open a ChatbotSession row and return its primary key"""
+    from .models import ChatbotSession
+
+    return ChatbotSession.objects.create(customer=customer).pk
+
+
+class WriteBehindBuffer:
+    """
+    Queue of rows written to the database in batches.
+
+    Subclasses set ``setting_prefix`` (``<prefix>_BATCH_SIZE``,
+    ``<prefix>_FLUSH_INTERVAL`` and ``<prefix>_MAX_PENDING`` are read from
+    settings) and implement ``_write``. Extra state that has to be written
+    together with the rows goes through ``_take_state``/``_restore_state``.
+    """
+    setting_prefix = None
+    label = 'rows'
+
+    def __init__(self, batch_size=None, flush_interval=None, max_pending=None):
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+        self._tasks = set()
+
+    def _setting(self, value, name, default):
+        if value is not None:
+            return value
+        return getattr(settings, f'{self.setting_prefix}_{name}', default)
+
+    @property
+    def batch_size(self):
+        return self._setting(self._batch_size, 'BATCH_SIZE', 100)
+
+    @property
+    def flush_interval(self):
+        return self._setting(self._flush_interval, 'FLUSH_INTERVAL', 2.0)
+
+    @property
+    def max_pending(self):
+        return self._setting(self._max_pending, 'MAX_PENDING', 1000)
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def _queue(self, row):
+        """Queue one row, waiting for a flush if the buffer is full"""
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+        with self._lock:
+            self._pending.append(row)
+            pending = len(self._pending)
+
+        if pending >= self.batch_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_later(self.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _take_state(self):
+        return None
+
+    def _restore_state(self, state):
+        pass
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+            state = self._take_state()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        return batch, state
+
+    def _restore(self, batch, state):
+        with self._lock:
+            room = max(self.max_pending - len(self._pending), 0)
+            if room < len(batch):
+                logger.error("Dropping %d %s after a failed flush",
+                             len(batch) - room, self.label)
+            self._pending[:0] = batch[len(batch) - room:]
+            self._restore_state(state)
+
+    async def flush(self):
+        """Write every pending row to the database"""
+        batch, state = self._take()
+        if not batch and not state:
+            return
+        try:
+            await database_sync_to_async(self._write)(batch, state)
+        except Exception:
+            logger.exception("Failed to flush %s", self.label)
+            self._restore(batch, state)
+
+    def flush_sync(self):
+        """Blocking flush used when the worker shuts down"""
+        batch, state = self._take()
+        if batch or state:
+            self._write(batch, state)
+
+    def _write(self, batch, state):
+        raise NotImplementedError
+
+
+class TranscriptBuffer(WriteBehindBuffer):
+    setting_prefix = 'CHATBOT_TRANSCRIPT'
+    label = 'chatbot messages'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._closed_sessions = set()
+
+    async def add(self, session_id, is_bot, content):
+        await self._queue((session_id, is_bot, content, timezone.now()))
+
+    def close_session(self, session_id):
+        """Mark a session inactive as part of the next flush"""
+        with self._lock:
+            self._closed_sessions.add(session_id)
+
+    def _take_state(self):
+        closed, self._closed_sessions = self._closed_sessions, set()
+        return closed
+
+    def _restore_state(self, closed):
+        self._closed_sessions |= closed
+
+    def _write(self, batch, closed):
+        from .models import ChatbotMessage, ChatbotSession
+
+        last_activity = {}
+        for session_id, _, _, timestamp in batch:
+            last_activity[session_id] = timestamp
+
+        with transaction.atomic():
+            ChatbotMessage.objects.bulk_create([
+                ChatbotMessage(session_id=session_id, is_bot=is_bot,
+                               content=content, timestamp=timestamp)
+                for session_id, is_bot, content, timestamp in batch
+            ])
+            # QuerySet.update() skips auto_now, so last_activity is set explicitly
+            for session_id, timestamp in last_activity.items():
+                ChatbotSession.objects.filter(pk=session_id).update(
+                    last_activity=timestamp)
+            if closed:
+                ChatbotSession.objects.filter(pk__in=closed).update(is_active=False)
+
+
+transcript_buffer = TranscriptBuffer()
+atexit.register(transcript_buffer.flush_sync)
@@ -0,0 +1,72 @@
+"""
+Per-session replay buffers for chatbot socket resume.
+
+Every outbound bot message gets the next sequence number of its chatbot
+``session_id`` and is kept in a small ring buffer. A client that reconnects
+with ``?last_seq=N`` is sent only the messages after N, straight from
+memory. When the buffer no longer reaches back to N (or this worker has
+never seen the session, or has restarted), the connection starts over with
+the welcome message and sequence numbers that may start again from 1.
+"""
+import itertools
+from collections import OrderedDict, deque
+
+from django.conf import settings
+
+
+class ReplayBuffer:
+    __slots__ = ('seq', 'messages')
+
+    def __init__(self, size):
+        self.seq = 0
+        self.messages = deque(maxlen=size)
+
+    def append(self, payload):
+        """Number ``payload`` in place and remember it"""
+        self.seq += 1
+        payload['seq'] = self.seq
+        self.messages.append(payload)
+        return payload
+
+    def since(self, last_seq):
+        """Messages after ``last_seq``, or None if they can't all be replayed"""
+        missed = self.seq - last_seq
+        if missed < 0 or missed > len(self.messages):
+            return None
+        return list(itertools.islice(self.messages, len(self.messages) - missed, None))
+
+
+class ReplayStore:
+    def __init__(self, buffer_size=None, max_sessions=None):
+        self._buffer_size = buffer_size
+        self._max_sessions = max_sessions
+        self._buffers = OrderedDict()
+
+    @property
+    def buffer_size(self):
+        if self._buffer_size is not None:
+            return self._buffer_size
+        return getattr(settings, 'CHATBOT_REPLAY_BUFFER_SIZE', 50)
+
+    @property
+    def max_sessions(self):
+        if self._max_sessions is not None:
+            return self._max_sessions
+        return getattr(settings, 'CHATBOT_REPLAY_SESSIONS', 10000)
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def get(self, session_id):
+        """The session's buffer, created on first use; idle sessions are evicted"""
+        buffer = self._buffers.get(session_id)
+        if buffer is None:
+            buffer = self._buffers[session_id] = ReplayBuffer(self.buffer_size)
+            while len(self._buffers) > self.max_sessions:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(session_id)
+        return buffer
+
+
+replay_store = ReplayStore()
@@ -0,0 +1,57 @@
+"""
+LRU cache of chatbot replies keyed by the normalised message.
+
+Most chatbot traffic repeats a handful of phrases, so replies are memoised
+per generation, e.g. a rule-set snapshot together with the product index
+generation. A new generation empties the cache on first use.
+"""
+from collections import OrderedDict
+
+from django.conf import settings
+
+MISSING = object()
+
+
+class ReplyCache:
+    def __init__(self, max_size=None):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        if self._max_size is not None:
+            return self._max_size
+        return getattr(settings, 'CHATBOT_REPLY_CACHE_SIZE', 1024)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, generation, key):
+        """Return the cached reply, or MISSING"""
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+        reply = self._entries.get(key, MISSING)
+        if reply is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return reply
+
+    def set(self, generation, key, reply):
+        if generation != self._generation or self.max_size <= 0:
+            return
+        self._entries[key] = reply
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+reply_cache = ReplyCache()
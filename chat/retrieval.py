@@ -0,0 +1,76 @@
+"""
+BM25 retrieval over BotResponse rules.
+
+Used when no keyword matches a message outright. The index is built once
+per rule-set version (see ``chat.rules.RuleSnapshot``) and stores every
+term's BM25 weight per response up front, so scoring a message only walks
+the posting lists of the terms it contains.
+
+Response texts are full of filler ("How can I assist you today?"), so a
+response also has to cover a share of the message's terms: one word in
+common with a long off-topic question is not an answer.
+"""
+from collections import Counter, defaultdict
+
+from products.text import K1, B, bm25_weight, idf, words
+
+from .matcher import split_keywords
+
+# Keywords are the author's own description of a rule, so they count double
+KEYWORD_BOOST = 2
+
+
+class ResponseIndex:
+    def __init__(self, responses, k1=K1, b=B):
+        self.responses = list(responses)
+        documents = []
+        for response in self.responses:
+            terms = Counter(words(response.response_text))
+            for keyword in split_keywords(response.keywords):
+                for token in words(keyword):
+                    terms[token] += KEYWORD_BOOST
+            documents.append(terms)
+
+        lengths = [sum(terms.values()) for terms in documents]
+        average = (sum(lengths) / len(lengths)) if lengths else 0.0
+        frequency = Counter(term for terms in documents for term in terms)
+        total = len(documents)
+
+        # term -> ((response index, precomputed BM25 weight), ...)
+        postings = defaultdict(list)
+        for index, terms in enumerate(documents):
+            for term, tf in terms.items():
+                weight = bm25_weight(tf, lengths[index], average, k1, b)
+                postings[term].append((index, idf(frequency[term], total) * weight))
+        self._postings = {term: tuple(entries) for term, entries in postings.items()}
+
+    def __len__(self):
+        return len(self.responses)
+
+    def scores(self, message):
+        """Return {response index: BM25 score} for every response that shares a term"""
+        return self._score(set(words(message)))[0]
+
+    def _score(self, terms):
+        scores = defaultdict(float)
+        matched = Counter()
+        for term in terms:
+            for index, weight in self._postings.get(term, ()):
+                scores[index] += weight
+                matched[index] += 1
+        return scores, matched
+
+    def search(self, message, min_score=0.0, min_coverage=0.0):
+        """
+        Return the best scoring response above ``min_score`` that shares at
+        least ``min_coverage`` of the message's terms, or None
+        """
+        terms = set(words(message))
+        scores, matched = self._score(terms)
+        if not scores:
+            return None
+        # Highest score wins; equal scores go to the higher priority rule
+        index = max(scores, key=lambda i: (scores[i], self.responses[i].priority, -i))
+        if scores[index] < min_score or matched[index] < min_coverage * len(terms):
+            return None
+        return self.responses[index]
@@ -0,0 +1,199 @@
+"""
+Customer–retailer chat rooms.
+
+Room messages are fanned out to the room's group as soon as they are sent
+and written behind in batches by ``room_buffer``, so a busy retailer costs
+one INSERT per batch rather than one per message. The same transaction
+moves each room's ``RoomSummary`` forward, which is what inboxes read. The
+backlog is read newest first with keyset pagination on
+``(room, timestamp, id)``, merged with the room's archived messages once
+the page reaches back to them.
+"""
+import atexit
+import heapq
+
+from django.db import transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Least
+
+from .archive import archived_messages
+from .cursors import decode_cursor, encode_cursor
+from .persistence import WriteBehindBuffer
+
+BACKLOG_PAGE_SIZE = 50
+MAX_BACKLOG_PAGE_SIZE = 100
+INBOX_PAGE_SIZE = 20
+MAX_INBOX_PAGE_SIZE = 50
+PREVIEW_LENGTH = 200
+SIDES = ('customer', 'retailer')
+
+
+def room_side(room_id, user):
+    """'customer' or 'retailer' for a member of the room, else None"""
+    from .models import ChatRoom
+
+    members = ChatRoom.objects.filter(pk=room_id).values_list(
+        'customer_id', 'retailer_id').first()
+    if members is None:
+        return None
+    customer_id, retailer_id = members
+    if user.pk == customer_id:
+        return 'customer'
+    if user.pk == retailer_id:
+        return 'retailer'
+    return None
+
+
+class RoomMessageBuffer(WriteBehindBuffer):
+    setting_prefix = 'CHAT_ROOM_MESSAGES'
+    label = 'chat room messages'
+
+    async def add(self, room_id, sender_type, content, timestamp):
+        await self._queue((room_id, sender_type, content, timestamp))
+
+    def _write(self, batch, state):
+        from .models import Message
+
+        # Per room: messages sent by each side and the newest message
+        rooms = {}
+        for room_id, sender_type, content, timestamp in batch:
+            sent = rooms.setdefault(room_id, {'customer': 0, 'retailer': 0})
+            sent[sender_type] += 1
+            if 'last' not in sent or timestamp >= sent['last'][2]:
+                sent['last'] = (sender_type, content, timestamp)
+
+        with transaction.atomic():
+            Message.objects.bulk_create([
+                Message(room_id=room_id, sender_type=sender_type,
+                        content=content, timestamp=timestamp)
+                for room_id, sender_type, content, timestamp in batch
+            ])
+            for room_id, sent in rooms.items():
+                update_summary(room_id, sent)
+
+
+def update_summary(room_id, sent):
+    """Move a room's inbox row forward by one batch of its messages"""
+    from .models import ChatRoom, RoomSummary
+
+    sender_type, content, timestamp = sent['last']
+    # Another worker may already have written newer messages for the room
+    newer = Q(last_timestamp__lte=timestamp)
+    updated = RoomSummary.objects.filter(room_id=room_id).update(
+        last_message=Case(When(newer, then=Value(content[:PREVIEW_LENGTH])),
+                          default=F('last_message')),
+        last_sender_type=Case(When(newer, then=Value(sender_type)),
+                              default=F('last_sender_type')),
+        last_timestamp=Case(When(newer, then=Value(timestamp)),
+                            default=F('last_timestamp')),
+        customer_unread=F('customer_unread') + sent['retailer'],
+        retailer_unread=F('retailer_unread') + sent['customer'],
+    )
+    if not updated:
+        customer_id, retailer_id = ChatRoom.objects.filter(pk=room_id).values_list(
+            'customer_id', 'retailer_id').get()
+        RoomSummary.objects.create(
+            room_id=room_id, customer_id=customer_id, retailer_id=retailer_id,
+            last_message=content[:PREVIEW_LENGTH], last_sender_type=sender_type,
+            last_timestamp=timestamp, customer_unread=sent['retailer'],
+            retailer_unread=sent['customer'])
+
+
+def mark_room_read(room_id, side, until=None):
+    """
+    Lower one side's unread counter to the messages sent to it after
+    ``until``, or clear it when ``until`` is None
+    """
+    from .models import Message, RoomSummary
+
+    unread = 0
+    if until is not None:
+        other = 'retailer' if side == 'customer' else 'customer'
+        unread = Message.objects.filter(
+            room_id=room_id, sender_type=other, timestamp__gt=until).count()
+    # Only ever lowered, so a stale receipt can't bring back read messages
+    RoomSummary.objects.filter(room_id=room_id).update(
+        **{f'{side}_unread': Least(F(f'{side}_unread'), Value(unread))})
+
+
+room_buffer = RoomMessageBuffer()
+atexit.register(room_buffer.flush_sync)
+
+
+def backlog_page(room_id, cursor=None, limit=BACKLOG_PAGE_SIZE):
+    """Return ``(messages, next_cursor)``, newest first, for one page of a room"""
+    from .models import ArchivedTranscript, Message
+
+    limit = max(1, min(limit, MAX_BACKLOG_PAGE_SIZE))
+    messages = Message.objects.filter(room_id=room_id).order_by('-timestamp', '-id')
+    before = None
+    if cursor:
+        before = decode_cursor(cursor)
+        timestamp, pk = before
+        messages = messages.filter(
+            Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, pk__lt=pk))
+
+    # Fetch one extra row to know whether another page exists
+    page = list(messages[:limit + 1])
+
+    # Archives only reach into the page once it runs past the live rows' span
+    archives = ArchivedTranscript.objects.filter(kind='room', source_id=room_id)
+    if len(page) > limit:
+        archives = archives.filter(last_timestamp__gte=page[-1].timestamp)
+    if archives.exists():
+        archived = [
+            message for message in archived_messages('room', [room_id]).get(room_id, ())
+            if before is None or (message.timestamp, message.pk) < before
+        ]
+        live = {message.pk for message in page}
+        # Rows left behind by an interrupted archive run are in both
+        archived = [message for message in archived if message.pk not in live]
+        page = list(heapq.merge(page, reversed(archived),
+                                key=lambda m: (m.timestamp, m.pk), reverse=True))[:limit + 1]
+
+    next_cursor = None
+    if len(page) > limit:
+        next_cursor = encode_cursor(page[limit - 1].timestamp, page[limit - 1].pk)
+    return page[:limit], next_cursor
+
+
+def serialize_message(message):
+    return {
+        'id': message.pk,
+        'sender_type': message.sender_type,
+        'message': message.content,
+        'timestamp': message.timestamp.isoformat(),
+    }
+
+
+def inbox_page(user, side, cursor=None, limit=INBOX_PAGE_SIZE):
+    """Return ``(summaries, next_cursor)`` for the rooms ``user`` is on ``side`` of"""
+    from .models import RoomSummary
+
+    limit = max(1, min(limit, MAX_INBOX_PAGE_SIZE))
+    summaries = RoomSummary.objects.filter(**{f'{side}_id': user.pk}).order_by(
+        '-last_timestamp', '-room_id')
+    if cursor:
+        timestamp, room_id = decode_cursor(cursor)
+        summaries = summaries.filter(
+            Q(last_timestamp__lt=timestamp) | Q(last_timestamp=timestamp, room_id__lt=room_id))
+
+    # Fetch one extra row to know whether another page exists
+    page = list(summaries[:limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        next_cursor = encode_cursor(page[limit - 1].last_timestamp, page[limit - 1].room_id)
+    return page[:limit], next_cursor
+
+
+def serialize_summary(summary, side):
+    return {
+        'room': summary.room_id,
+        'customer': summary.customer_id,
+        'retailer': summary.retailer_id,
+        'last_message': summary.last_message,
+        'last_sender_type': summary.last_sender_type,
+        'last_timestamp': summary.last_timestamp.isoformat(),
+        'unread': getattr(summary, f'{side}_unread'),
+    }
+
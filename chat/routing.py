@@ -4,4 +4,6 @@ from . import consumers
 websocket_urlpatterns = [
     re_path(r'ws/chatbot/(?P<session_id>[^/]+)/$',
             consumers.ChatbotConsumer.as_asgi()),
+    re_path(r'ws/chat/(?P<room_id>\d+)/$',
+            consumers.ChatRoomConsumer.as_asgi()),
 ]
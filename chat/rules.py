@@ -0,0 +1,92 @@
+"""
+Process-local snapshot of the BotResponse rule set.
+
+Each worker keeps the compiled rules in memory and only looks at the
+shared ``BotResponseVersion`` stamp once per ``CHATBOT_RULES_CHECK_INTERVAL``
+seconds, reloading the rules when the stamp has moved. Chat messages in
+between never touch the database.
+"""
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .matcher import KeywordMatcher
+from .retrieval import ResponseIndex
+
+
+class RuleSnapshot:
+    """An immutable, compiled copy of the rules at a given version"""
+
+    def __init__(self, version, responses):
+        self.version = version
+        self.responses = tuple(responses)
+        self.matcher = KeywordMatcher(self.responses)
+        self.index = ResponseIndex(self.responses)
+        # Responses arrive highest priority first, so this is the preferred fallback
+        self.fallback = next(
+            (r for r in self.responses if r.category == 'fallback'), None)
+
+
+EMPTY_SNAPSHOT = RuleSnapshot(None, ())
+
+
+class RuleCache:
+    def __init__(self, check_interval=None):
+        self._check_interval = check_interval
+        self._snapshot = EMPTY_SNAPSHOT
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def check_interval(self):
+        if self._check_interval is not None:
+            return self._check_interval
+        return getattr(settings, 'CHATBOT_RULES_CHECK_INTERVAL', 5)
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def is_fresh(self):
+        return (self._checked_at is not None
+                and time.monotonic() - self._checked_at < self.check_interval)
+
+    def invalidate(self):
+        """Force the next lookup to re-check the version stamp"""
+        self._checked_at = None
+
+    def get(self):
+        """Return the current snapshot, reloading it if the version moved"""
+        if self.is_fresh():
+            return self._snapshot
+
+        from .models import BotResponse, BotResponseVersion
+
+        with self._lock:
+            if self.is_fresh():
+                return self._snapshot
+            version = BotResponseVersion.current()
+            if version != self._snapshot.version:
+                responses = BotResponse.objects.order_by('-priority', 'pk')
+                self._snapshot = RuleSnapshot(version, responses)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    async def aget(self):
+        """Async variant of get() that skips the thread hop when fresh"""
+        if self.is_fresh():
+            return self._snapshot
+        return await database_sync_to_async(self.get)()
+
+
+rule_cache = RuleCache()
+
+
+def bump_rules_version():
+    """Mark the rule set as changed for every worker"""
+    from .models import BotResponseVersion
+
+    BotResponseVersion.bump()
+    rule_cache.invalidate()
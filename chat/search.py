@@ -0,0 +1,181 @@
+"""
+Full-text search over chat messages.
+
+On MySQL the message columns carry FULLTEXT indexes and searches run as
+``MATCH ... AGAINST`` in boolean mode, so every word must appear. Other
+backends (SQLite in tests and development) use an in-process inverted index
+with the same all-words semantics. It is topped up from the newest primary
+key on each search and rebuilt when rows have been deleted.
+"""
+import re
+import threading
+from collections import defaultdict
+
+from django.contrib import messages
+from django.db import NotSupportedError, connection
+from django.db.models import Lookup, Max, Count, Q
+
+from .archive import SOURCES
+
+# kind -> searchable text column of the message model
+SEARCH_FIELDS = {
+    'chatbot': 'content',
+    'chat': 'message',
+    'room': 'content',
+}
+MAX_RESULTS = 1000
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return set(TOKEN_RE.findall((text or '').casefold()))
+
+
+class FullTextMatch(Lookup):
+    """``field__match='+red +roses'``, backed by a MySQL FULLTEXT index"""
+    lookup_name = 'match'
+
+    def as_mysql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'MATCH ({lhs}) AGAINST ({rhs} IN BOOLEAN MODE)', lhs_params + rhs_params
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError('Full-text matching needs MySQL')
+
+
+for _kind, _field in SEARCH_FIELDS.items():
+    SOURCES[_kind][0]._meta.get_field(_field).register_lookup(FullTextMatch)
+
+
+class MessageIndex:
+    """Inverted index from word to message ids for one message model"""
+
+    def __init__(self, model, field):
+        self.model = model
+        self.field = field
+        self._postings = defaultdict(set)
+        self._watermark = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            stamp = self.model.objects.aggregate(
+                latest=Max('pk'), indexed=Count('pk', filter=Q(pk__lte=self._watermark)))
+            latest = stamp['latest'] or 0
+            if latest < self._watermark or stamp['indexed'] != self._count:
+                # Rows were deleted (or ids reused); start over
+                self._postings.clear()
+                self._watermark = self._count = 0
+            if latest > self._watermark:
+                rows = self.model.objects.filter(pk__gt=self._watermark).order_by('pk')
+                for pk, text in rows.values_list('pk', self.field).iterator():
+                    for token in tokenize(text):
+                        self._postings[token].add(pk)
+                    self._watermark = pk
+                    self._count += 1
+
+    def search(self, query, limit=MAX_RESULTS):
+        """Ids of messages containing every word of ``query``, newest first"""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        self.refresh()
+        with self._lock:
+            postings = sorted((self._postings.get(term, set()) for term in terms), key=len)
+            ids = set.intersection(*postings)
+        return sorted(ids, reverse=True)[:limit]
+
+
+_indexes = {}
+
+
+def message_index(kind):
+    if kind not in _indexes:
+        _indexes[kind] = MessageIndex(SOURCES[kind][0], SEARCH_FIELDS[kind])
+    return _indexes[kind]
+
+
+def match_term(query):
+    """``query`` as a boolean-mode AGAINST string requiring every word, or None if it has none"""
+    terms = TOKEN_RE.findall(query)
+    return ' '.join(f'+{t}' for t in terms) if terms else None
+
+
+def search_q(kind, query):
+    """A Q object matching the ``kind`` messages that contain every word of ``query``"""
+    if connection.vendor == 'mysql':
+        against = match_term(query)
+        if against is None:
+            return Q(pk__in=[])
+        return Q(**{f'{SEARCH_FIELDS[kind]}__match': against})
+    return Q(pk__in=message_index(kind).search(query))
+
+
+def search_ids(kind, query, limit=MAX_RESULTS):
+    """
+    Ids of the newest ``limit`` ``kind`` messages containing every word of
+    ``query``, and whether more than that matched
+    """
+    if connection.vendor == 'mysql':
+        against = match_term(query)
+        if against is None:
+            return [], False
+        rows = (SOURCES[kind][0].objects.filter(**{f'{SEARCH_FIELDS[kind]}__match': against})
+                .order_by('-pk').values_list('pk', flat=True))
+        ids = list(rows[:limit + 1])
+    else:
+        ids = message_index(kind).search(query, limit + 1)
+    return ids[:limit], len(ids) > limit
+
+
+def search_messages(kind, query, limit=50):
+    """
+    Newest ``limit`` ``kind`` messages matching ``query`` as dicts, and
+    whether more matched than were returned
+    """
+    model, parent, _ = SOURCES[kind]
+    field = SEARCH_FIELDS[kind]
+    rows = list(model.objects.filter(search_q(kind, query))
+                .order_by('-timestamp', '-id')
+                .values('id', f'{parent}_id', field, 'timestamp')[:limit + 1])
+    return [
+        {
+            'kind': kind,
+            'id': row['id'],
+            'parent': row[f'{parent}_id'],
+            'content': row[field],
+            'timestamp': row['timestamp'].isoformat(),
+        }
+        for row in rows[:limit]
+    ], len(rows) > limit
+
+
+class FullTextSearchMixin:
+    """
+    ModelAdmin mixin searching ``search_kind`` messages through the full-text index.
+
+    ``search_exact`` lists lookups (e.g. a username) that are matched exactly
+    as well as the text. Each runs as its own query on its own index and the
+    matching ids are combined; OR-ing them into one WHERE clause would make
+    MySQL scan the table. Text matches are capped at the newest
+    ``search_limit``, with a warning when more matched.
+    """
+    search_kind = None
+    search_exact = ()
+    search_limit = MAX_RESULTS
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        ids, truncated = search_ids(self.search_kind, search_term, self.search_limit)
+        pks = set(ids)
+        for lookup in self.search_exact:
+            pks.update(queryset.filter(**{lookup: search_term}).values_list('pk', flat=True))
+        if truncated:
+            self.message_user(
+                request, f'Only the newest {self.search_limit} text matches are shown; '
+                'add words to narrow the search.', messages.WARNING)
+        return queryset.filter(pk__in=pks), False
@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import BotResponse, ChatRoom, RoomSummary
+from .rules import bump_rules_version
+
+
+@receiver(post_save, sender=BotResponse)
+@receiver(post_delete, sender=BotResponse)
+def bot_response_changed(sender, **kwargs):
+    bump_rules_version()
+
+
+@receiver(post_save, sender=ChatRoom)
+def chat_room_created(sender, instance, created, **kwargs):
+    if created:
+        RoomSummary.objects.get_or_create(room=instance, defaults={
+            'customer_id': instance.customer_id,
+            'retailer_id': instance.retailer_id,
+            'last_timestamp': instance.created_at,
+        })
+
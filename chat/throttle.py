@@ -0,0 +1,104 @@
+"""
+Token-bucket rate limiting for chatbot sockets.
+
+Every connection gets its own bucket and every chatbot ``session_id`` shares
+one bucket across all of its connections in the worker, so opening more
+sockets does not buy a client more throughput. Frames over the limit are
+dropped before they are parsed, and a socket that keeps hitting the limit
+is closed.
+"""
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def consume(self, now=None):
+        """Take one token; False when the bucket is empty"""
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Throttle:
+    def __init__(self, rate=None, burst=None, session_rate=None, session_burst=None,
+                 close_after=None, max_sessions=10000):
+        self._rate = rate
+        self._burst = burst
+        self._session_rate = session_rate
+        self._session_burst = session_burst
+        self._close_after = close_after
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self.throttled = 0
+        self.closed = 0
+
+    def _setting(self, value, name, default):
+        if value is not None:
+            return value
+        return getattr(settings, name, default)
+
+    @property
+    def rate(self):
+        return self._setting(self._rate, 'CHATBOT_RATE_LIMIT', 2.0)
+
+    @property
+    def burst(self):
+        return self._setting(self._burst, 'CHATBOT_RATE_BURST', 10)
+
+    @property
+    def session_rate(self):
+        return self._setting(self._session_rate, 'CHATBOT_SESSION_RATE_LIMIT', 4.0)
+
+    @property
+    def session_burst(self):
+        return self._setting(self._session_burst, 'CHATBOT_SESSION_RATE_BURST', 20)
+
+    @property
+    def close_after(self):
+        return self._setting(self._close_after, 'CHATBOT_THROTTLE_CLOSE_AFTER', 20)
+
+    def connection_bucket(self, now=None):
+        return TokenBucket(self.rate, self.burst, now)
+
+    def session_bucket(self, session_id, now=None):
+        bucket = self._sessions.get(session_id)
+        if bucket is None:
+            bucket = self._sessions[session_id] = TokenBucket(
+                self.session_rate, self.session_burst, now)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        else:
+            self._sessions.move_to_end(session_id)
+        return bucket
+
+    def allow(self, bucket, session_id, now=None):
+        """Charge one frame to a connection bucket and its session's bucket"""
+        if self.rate > 0 and not bucket.consume(now):
+            self.throttled += 1
+            return False
+        if self.session_rate > 0 and not self.session_bucket(session_id, now).consume(now):
+            self.throttled += 1
+            return False
+        return True
+
+    def stats(self):
+        return {'throttled': self.throttled, 'closed': self.closed,
+                'sessions': len(self._sessions)}
+
+
+throttle = Throttle()
@@ -9,4 +9,8 @@ urlpatterns = [
     path("chatbot/", views.chatbot_view, name="chatbot"),
     path("chatbot-structure/", views.chatbot_structure, name="chatbot_structure"),
     path("history/", views.chat_history, name="chat_history"),
+    path("history/api/", views.chat_history_api, name="chat_history_api"),
+    path("inbox/", views.chat_inbox_api, name="chat_inbox_api"),
+    path("rooms/<int:room_id>/messages/", views.room_messages_api, name="room_messages_api"),
+    path("support/search/", views.support_search_api, name="support_search_api"),
 ]
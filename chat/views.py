@@ -1,6 +1,16 @@
 from django.shortcuts import render
 from django.contrib.auth.decorators import login_required
+from django.http import Http404, JsonResponse
+from .history import InvalidCursor, history_page, serialize_session
 from .models import ChatbotSession, BotResponse
+from .rooms import (
+    BACKLOG_PAGE_SIZE, INBOX_PAGE_SIZE, SIDES, backlog_page, inbox_page, room_side,
+    serialize_message, serialize_summary,
+)
+from .search import SEARCH_FIELDS, search_messages
+
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_PAGE_SIZE = 200
 
 
 def chat_index(request):
@@ -39,12 +49,102 @@ def chatbot_structure(request):
 @login_required
 def chat_history(request):
     """View chat history for logged in users"""
-    sessions = ChatbotSession.objects.filter(
-        customer=request.user.customer
-    ).order_by('-created_at')
+    try:
+        sessions, next_cursor = history_page(
+            request.user, cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        sessions, next_cursor = history_page(request.user)
 
     context = {
         'page_title': 'Chat History',
-        'sessions': sessions
+        'sessions': sessions,
+        'next_cursor': next_cursor,
     }
     return render(request, "history.html", context)
+
+
+def chat_history_api(request):
+    """JSON chat history, newest first, paginated with an opaque cursor"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    try:
+        limit = int(request.GET.get('limit', 20))
+        sessions, next_cursor = history_page(
+            request.user, cursor=request.GET.get('cursor'), limit=limit)
+    except (InvalidCursor, ValueError):
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+
+    return JsonResponse({
+        'results': [serialize_session(session) for session in sessions],
+        'next': next_cursor,
+    })
+
+
+def room_messages_api(request, room_id):
+    """A chat room's backlog, newest first, paginated with an opaque cursor"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    if room_side(room_id, request.user) is None:
+        raise Http404
+
+    try:
+        limit = int(request.GET.get('limit', BACKLOG_PAGE_SIZE))
+        messages, next_cursor = backlog_page(
+            room_id, cursor=request.GET.get('cursor'), limit=limit)
+    except (InvalidCursor, ValueError):
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+
+    return JsonResponse({
+        'results': [serialize_message(message) for message in messages],
+        'next': next_cursor,
+    })
+
+
+def chat_inbox_api(request):
+    """The user's chat rooms, most recent activity first, with unread counts"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    side = request.GET.get('as', 'customer')
+    if side not in SIDES:
+        return JsonResponse({'error': "'as' must be customer or retailer"}, status=400)
+
+    try:
+        limit = int(request.GET.get('limit', INBOX_PAGE_SIZE))
+        summaries, next_cursor = inbox_page(
+            request.user, side, cursor=request.GET.get('cursor'), limit=limit)
+    except (InvalidCursor, ValueError):
+        return JsonResponse({'error': 'Invalid cursor or limit'}, status=400)
+
+    return JsonResponse({
+        'results': [serialize_summary(summary, side) for summary in summaries],
+        'next': next_cursor,
+    })
+
+
+def support_search_api(request):
+    """Staff search across chatbot, chat and room messages; every word must match"""
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff only'}, status=403)
+
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': "'q' is required"}, status=400)
+    kinds = request.GET.getlist('kind') or list(SEARCH_FIELDS)
+    if any(kind not in SEARCH_FIELDS for kind in kinds):
+        return JsonResponse({'error': "'kind' must be chatbot, chat or room"}, status=400)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', SEARCH_PAGE_SIZE)), MAX_SEARCH_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+
+    found = {kind: search_messages(kind, query, limit) for kind in kinds}
+    return JsonResponse({
+        'query': query,
+        'results': {kind: rows for kind, (rows, _) in found.items()},
+        # More messages matched than were returned; narrow the query to see them
+        'truncated': {kind: truncated for kind, (_, truncated) in found.items()},
+    })
@@ -1,3 +1,13 @@
 from django.contrib import admin
+from django.contrib.auth.admin import UserAdmin
+from .models import Customer
 
-# Register your models here.
+
+@admin.register(Customer)
+class CustomerAdmin(UserAdmin):
+    list_display = ['username', 'email', 'phone_number', 'is_staff', 'is_active']
+    # Also backs the autocomplete widgets and filters for customer foreign keys
+    search_fields = ['username', 'email']
+    fieldsets = UserAdmin.fieldsets + (
+        ('Contact Details', {'fields': ('phone_number', 'address')}),
+    )
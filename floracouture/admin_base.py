@@ -0,0 +1,98 @@
+"""
+Shared admin base for change lists over large tables.
+
+``LargeTableAdmin`` pages with ``EstimatedCountPaginator`` and never runs the
+unfiltered ``COUNT(*)`` Django adds next to filtered results. Subclasses
+still declare ``list_select_related`` for whatever their ``list_display``
+follows. Use ``AutocompleteFilter`` in ``list_filter`` for foreign keys to big
+tables: it searches through the related admin's autocomplete view instead of
+rendering every row as a link.
+"""
+from django import forms
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.options import ShowFacets
+from django.contrib.admin.utils import get_last_value_from_parameters
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+
+def estimated_row_count(model, using='default'):
+    """The table's row estimate from the database statistics, if it keeps one"""
+    connection = connections[using]
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT TABLE_ROWS FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts more than ``ADMIN_EXACT_COUNT_LIMIT`` rows.
+
+    Unfiltered lists over bigger tables report MySQL's row estimate. Filtered
+    lists are counted up to the limit plus one, so a filter that still
+    matches millions of rows shows the limit plus one and should be narrowed.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 100000)
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit + 1].count()
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """List filter for a foreign key, picked with the related admin's autocomplete"""
+    template = 'admin/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = '%s__%s__exact' % (field_path, field.target_field.name)
+        self.lookup_val = get_last_value_from_parameters(params, self.lookup_kwarg)
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': changelist.get_query_string(remove=[self.lookup_kwarg]),
+            'display': _('All'),
+        }
+
+    def rendered_widget(self):
+        return self.form_field.widget.render(self.lookup_kwarg, self.lookup_val)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    # Facet counts run one COUNT per filter choice
+    show_facets = ShowFacets.NEVER
+
+    @property
+    def media(self):
+        media = super().media
+        if any(isinstance(spec, tuple) and spec[1] is AutocompleteFilter
+               for spec in self.list_filter):
+            media += AutocompleteSelect(None, self.admin_site).media
+        return media
@@ -59,6 +59,13 @@ AUTH_USER_MODEL = 'customers.Customer'
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        # To share groups between several daphne processes on one host, run
+        # `manage.py run_channel_broker` and use (the socket defaults to
+        # run/channels.sock under the project):
+        # 'BACKEND': 'chat.layers.UnixSocketChannelLayer',
+        # 'CONFIG': {
+        #     'path': os.path.join(BASE_DIR, 'run', 'channels.sock'),
+        # },
         # For production, use Redis:
         # 'BACKEND': 'channels_redis.core.RedisChannelLayer',
         # 'CONFIG': {
@@ -67,6 +74,92 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Chatbot: how often (seconds) each worker re-checks the BotResponse version stamp
+CHATBOT_RULES_CHECK_INTERVAL = 5
+
+# When no keyword matches, rank responses with BM25 and answer with the best
+# one scoring at least CHATBOT_RETRIEVAL_MIN_SCORE that also shares at least
+# CHATBOT_RETRIEVAL_MIN_COVERAGE of the message's words (else the fallback category)
+CHATBOT_RETRIEVAL_ENABLED = True
+CHATBOT_RETRIEVAL_MIN_SCORE = 1.0
+CHATBOT_RETRIEVAL_MIN_COVERAGE = 0.5
+
+# Messages no rule answers get a product listing only when a product's name
+# holds at least this share of their words
+CHATBOT_PRODUCT_NAME_COVERAGE = 0.6
+
+# Per-worker LRU of replies keyed by the normalised message
+CHATBOT_REPLY_CACHE_SIZE = 1024
+
+# Chatbot token buckets: messages per second and burst size per connection and
+# per chat session_id; a socket is closed after this many throttled frames
+CHATBOT_RATE_LIMIT = 2.0
+CHATBOT_RATE_BURST = 10
+CHATBOT_SESSION_RATE_LIMIT = 4.0
+CHATBOT_SESSION_RATE_BURST = 20
+CHATBOT_THROTTLE_CLOSE_AFTER = 20
+
+# Batch framing (?framing=batch or an array frame): at most this many messages
+# per inbound array, and bot replies produced within this many seconds share
+# one outbound array frame
+CHATBOT_MAX_BATCH_MESSAGES = 20
+CHATBOT_COALESCE_WINDOW = 0.02
+
+# Chatbot resume: each worker keeps this many recent bot messages for up to
+# CHATBOT_REPLAY_SESSIONS session_ids, replayed on reconnect with ?last_seq=N
+CHATBOT_REPLAY_BUFFER_SIZE = 50
+CHATBOT_REPLAY_SESSIONS = 10000
+
+# Let daphne accept permessage-deflate, compressing frames of at least
+# CHATBOT_DEFLATE_MIN_BYTES bytes. Sockets negotiate no context takeover and
+# 2**CHATBOT_DEFLATE_WINDOW_BITS byte windows (9-15) so each keeps a few KB of
+# zlib state rather than ~300KB
+CHATBOT_WEBSOCKET_DEFLATE = True
+CHATBOT_DEFLATE_MIN_BYTES = 512
+CHATBOT_DEFLATE_WINDOW_BITS = 10
+CHATBOT_DEFLATE_MEM_LEVEL = 4
+
+# Chatbot sockets are spread over this many broadcast groups; a broadcast is
+# one group_send per group
+CHATBOT_BROADCAST_SHARDS = 16
+
+# How often (seconds) each worker pulls product changes made by other processes
+# into its in-memory product catalog, along with new orders for suggestion ranking
+PRODUCT_INDEX_CHECK_INTERVAL = 5
+
+# Product rows are dated when saved, not when committed: each pull reaches
+# this many seconds further back so slow transactions are not missed
+PRODUCT_INDEX_REFRESH_OVERLAP = 30
+
+# Rendered product list/detail responses are cached for this many seconds
+# (product saves and deletes invalidate them in every worker); concurrent
+# misses in one worker wait up to this long for the first one to render
+PRODUCT_CACHE_TTL = 300
+PRODUCT_CACHE_LOCK_TIMEOUT = 5
+
+# Seconds the chatbot may keep a cached order status, and how often (seconds)
+# each worker checks whether orders were saved or deleted by other processes
+ORDER_STATUS_CACHE_TTL = 30
+ORDER_STATUS_CHECK_INTERVAL = 1
+
+# Chatbot transcripts are written in batches: flush after this many messages,
+# after this many seconds, and make senders wait once this many are pending
+CHATBOT_TRANSCRIPT_BATCH_SIZE = 100
+CHATBOT_TRANSCRIPT_FLUSH_INTERVAL = 2.0
+CHATBOT_TRANSCRIPT_MAX_PENDING = 1000
+
+# Customer-retailer chat rooms: messages are written in batches like chatbot
+# transcripts; typing and read events go out at most once per interval
+CHAT_ROOM_MESSAGES_BATCH_SIZE = 100
+CHAT_ROOM_MESSAGES_FLUSH_INTERVAL = 1.0
+CHAT_ROOM_MESSAGES_MAX_PENDING = 1000
+CHAT_ROOM_EVENT_INTERVAL = 1.0
+CHAT_MESSAGE_MAX_LENGTH = 2000
+
+# Admin change lists count at most this many rows; unfiltered lists over bigger
+# tables show the database's row estimate instead
+ADMIN_EXACT_COUNT_LIMIT = 100000
+
 # Set the ASGI application
 ASGI_APPLICATION = "floracouture.asgi.application"
 
@@ -1,19 +1,26 @@
 from django.contrib import admin
+from floracouture.admin_base import AutocompleteFilter, LargeTableAdmin
 from .models import Order, OrderItem
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
+    autocomplete_fields = ['product']
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['id', 'user', 'status', 'created_at']
-    list_filter = ['status', 'created_at']
+    list_filter = ['status', 'created_at', ('user', AutocompleteFilter)]
+    list_select_related = ['user']
     search_fields = ['user__username', 'user__email']
+    autocomplete_fields = ['user']
     inlines = [OrderItemInline]
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdmin):
     list_display = ['order', 'product', 'quantity']
-    list_filter = ['order__status']
+    list_filter = ['order__status', ('product', AutocompleteFilter)]
+    # Order.__str__ shows the user's name, OrderItem's shows the product's
+    list_select_related = ['order__user', 'product']
     search_fields = ['product__name']
+    autocomplete_fields = ['order', 'product']
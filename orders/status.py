@@ -0,0 +1,90 @@
+"""
+Short-lived cache of order statuses for the chatbot.
+
+Order-status questions are the most common chatbot request, so lookups go
+through Django's cache for ``ORDER_STATUS_CACHE_TTL`` seconds and use the
+async ORM on a miss, keeping the consumer's event loop free.
+
+Entries are keyed by the shared ``OrderStatusVersion`` stamp, which is bumped
+when the transaction that saved or deleted any order commits. Each worker
+looks at the stamp at most once per ``ORDER_STATUS_CHECK_INTERVAL`` seconds,
+so a change made by another process is seen within that interval and one
+made in this process straight away, whatever cache backend holds the entries.
+
+Writes that skip model signals, such as ``QuerySet.update()``, must call
+``bump_order_status_version()`` themselves.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+class OrderStatusCache:
+    prefix = 'order-status'
+
+    def __init__(self, check_interval=None):
+        self._check_interval = check_interval
+        self._version = 0
+        self._checked_at = None
+
+    @property
+    def check_interval(self):
+        if self._check_interval is not None:
+            return self._check_interval
+        return getattr(settings, 'ORDER_STATUS_CHECK_INTERVAL', 1)
+
+    def is_fresh(self):
+        return (self._checked_at is not None
+                and time.monotonic() - self._checked_at < self.check_interval)
+
+    def invalidate(self):
+        """Force the next lookup to re-check the version stamp"""
+        self._checked_at = None
+
+    async def aversion(self):
+        if self.is_fresh():
+            return self._version
+
+        from .models import OrderStatusVersion
+
+        version = await (OrderStatusVersion.objects.filter(pk=1)
+                         .values_list('version', flat=True).afirst())
+        self._version = version or 0
+        self._checked_at = time.monotonic()
+        return self._version
+
+    async def aget(self, order_id):
+        """Return ``(user_id, status)`` for an order, or None if it does not exist"""
+        from .models import Order
+
+        key = f'{self.prefix}:{await self.aversion()}:{order_id}'
+        cached = await cache.aget(key)
+        if cached is not None:
+            return cached
+
+        row = await Order.objects.filter(pk=order_id).values_list('user_id', 'status').afirst()
+        if row is not None:
+            row = tuple(row)
+            await cache.aset(key, row, getattr(settings, 'ORDER_STATUS_CACHE_TTL', 30))
+        return row
+
+
+status_cache = OrderStatusCache()
+
+
+async def aget_order_status(order_id):
+    """Return ``(user_id, status)`` for an order, or None if it does not exist"""
+    return await status_cache.aget(order_id)
+
+
+def bump_order_status_version():
+    """Mark order statuses as changed for every worker once the transaction commits"""
+    from .models import OrderStatusVersion
+
+    def bump():
+        OrderStatusVersion.bump()
+        status_cache.invalidate()
+
+    transaction.on_commit(bump)
@@ -3,9 +3,18 @@ from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from django.contrib.auth import get_user_model
-from .models import Order, OrderItem
+from .models import Order, OrderItem, OrderStatusVersion
 from products.models import Product
 from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, force_authenticate
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from floracouture.admin_base import EstimatedCountPaginator
+from .status import OrderStatusCache, aget_order_status, status_cache
+from .views import UpdateOrderStatusView
 
 User = get_user_model()
 
@@ -216,3 +225,115 @@ class OrderAPITests(TestCase):
         """Test cancelling an order without authentication."""
         response = self.client.delete(self.cancel_order_url)
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class OrderStatusCacheTests(TestCase):
+    """Tests for the cached order status used by the chatbot"""
+
+    def setUp(self):
+        cache.clear()
+        status_cache.invalidate()
+        self.customer = User.objects.create_user(
+            username='cachedcustomer',
+            email='cached@example.com',
+            password='customerpassword123'
+        )
+        self.order = Order.objects.create(user=self.customer, status='Pending')
+
+    def test_update_status_view_invalidates_cache(self):
+        """Test that a status change is visible straight away."""
+        self.assertEqual(async_to_sync(aget_order_status)(self.order.pk),
+                         (self.customer.pk, 'Pending'))
+
+        request = APIRequestFactory().patch(
+            '/', {'status': 'Shipped'}, format='json')
+        force_authenticate(request, user=self.customer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = UpdateOrderStatusView.as_view()(request, pk=self.order.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(async_to_sync(aget_order_status)(self.order.pk),
+                         (self.customer.pk, 'Shipped'))
+
+    def test_any_save_or_delete_invalidates_cache(self):
+        """Test that changes made outside the order views are seen too."""
+        async_to_sync(aget_order_status)(self.order.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'Delivered'
+            self.order.save()
+        self.assertEqual(async_to_sync(aget_order_status)(self.order.pk),
+                         (self.customer.pk, 'Delivered'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.delete()
+        self.assertIsNone(async_to_sync(aget_order_status)(self.order.pk))
+
+    def test_uncommitted_changes_are_not_published(self):
+        start = OrderStatusVersion.current()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.order.status = 'Shipped'
+            self.order.save()
+        self.assertEqual(OrderStatusVersion.current(), start)
+        self.assertEqual(len(callbacks), 1)
+
+    def test_other_workers_see_the_change_within_the_check_interval(self):
+        """Test a bump made by another process, which skips this worker's own invalidation."""
+        worker = OrderStatusCache(check_interval=60)
+        self.assertEqual(async_to_sync(worker.aget)(self.order.pk), (self.customer.pk, 'Pending'))
+        Order.objects.filter(pk=self.order.pk).update(status='Shipped')
+        OrderStatusVersion.bump()
+        self.assertEqual(async_to_sync(worker.aget)(self.order.pk), (self.customer.pk, 'Pending'))
+
+        worker = OrderStatusCache(check_interval=0)
+        self.assertEqual(async_to_sync(worker.aget)(self.order.pk), (self.customer.pk, 'Shipped'))
+
+
+class AdminChangeListTests(TestCase):
+    """Change lists must not run a query per row or per related object"""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='adminpassword123')
+        self.client.force_login(self.admin)
+        self.retailer = User.objects.create_user(
+            username='florist', email='florist@example.com', password='retailerpassword123')
+        self.product = Product.objects.create(
+            retailer=self.retailer, name='Peony Bunch', price='25.00', stock=5)
+
+    def add_items(self, count):
+        for _ in range(count):
+            order = Order.objects.create(user=self.admin)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1)
+
+    def changelist_queries(self, url, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_order_item_list_queries_are_bounded(self):
+        url = reverse('admin:orders_orderitem_changelist')
+        self.add_items(2)
+        few = self.changelist_queries(url)
+        self.add_items(8)
+        self.assertEqual(self.changelist_queries(url), few)
+
+    def test_retailer_filter_uses_autocomplete(self):
+        other = User.objects.create_user(
+            username='grower', email='grower@example.com', password='retailerpassword123')
+        Product.objects.create(retailer=other, name='Tulips', price='9.00', stock=1)
+        url = reverse('admin:products_product_changelist')
+        response = self.client.get(url, {'retailer__id__exact': other.pk})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertContains(response, 'admin-autocomplete')
+        # Only the selected retailer is rendered, not every user
+        self.assertContains(response, 'grower')
+        self.assertNotContains(response, '>florist<')
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=3)
+    def test_paginator_caps_exact_counts(self):
+        self.add_items(5)
+        queryset = OrderItem.objects.order_by('pk')
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 4)
+        self.assertEqual(EstimatedCountPaginator(queryset.none(), 2).count, 0)
+        self.assertEqual(EstimatedCountPaginator(queryset.filter(quantity=1), 2).count, 4)
@@ -1,12 +1,18 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from floracouture.admin_base import AutocompleteFilter, LargeTableAdmin
 from .models import Product, Catalog
+from .search import product_search
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     list_display = ['name', 'price', 'stock', 'retailer', 'created_at', 'updated_at']
-    list_filter = ['retailer', 'created_at', 'stock']
+    list_filter = [('retailer', AutocompleteFilter), 'created_at', 'stock']
+    list_select_related = ['retailer']
     search_fields = ['name', 'description', 'retailer__username']
     readonly_fields = ['created_at', 'updated_at']
+    autocomplete_fields = ['retailer']
+    # Matches come from the in-memory search index rather than LIKE scans
+    search_limit = 1000
     fieldsets = [
         ('Product Information', {
             'fields': ['name', 'description', 'price', 'stock', 'image']
@@ -20,12 +26,28 @@ class ProductAdmin(admin.ModelAdmin):
         })
     ]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        hits, _ = product_search.refresh().query(search_term, limit=self.search_limit + 1)
+        pks = {entry.pk for entry, _ in hits[:self.search_limit]}
+        # A separate query on the username and retailer indexes; OR-ing it with
+        # the ids in one WHERE clause would make MySQL scan the table
+        pks.update(queryset.filter(retailer__username=search_term).values_list('pk', flat=True))
+        if len(hits) > self.search_limit:
+            self.message_user(
+                request, f'Only the best {self.search_limit} text matches are shown; '
+                'add words to narrow the search.', messages.WARNING)
+        return queryset.filter(pk__in=pks), False
+
 @admin.register(Catalog)
-class CatalogAdmin(admin.ModelAdmin):
+class CatalogAdmin(LargeTableAdmin):
     list_display = ['title', 'retailer', 'uploaded_at']
-    list_filter = ['retailer', 'uploaded_at']
+    list_filter = [('retailer', AutocompleteFilter), 'uploaded_at']
+    list_select_related = ['retailer']
     search_fields = ['title', 'description', 'retailer__username']
     readonly_fields = ['uploaded_at']
+    autocomplete_fields = ['retailer']
     fieldsets = [
         ('Catalog Information', {
             'fields': ['title', 'description', 'pdf_file']
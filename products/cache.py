@@ -0,0 +1,137 @@
+"""
+Cache of rendered product list and detail responses.
+
+Responses are stored as ``(etag, last modified, JSON bytes)`` in Django's
+cache, keyed by the query shape and a version: the catalog-wide one for
+lists, the retailer's own for lists filtered by retailer and the product's
+own for its detail. Versions are ``ProductCacheVersion`` rows, so every
+worker sees a bump as soon as the transaction that saved or deleted the
+product commits, whatever cache backend holds the responses. A cached read
+costs one indexed lookup of its version instead of the product query and
+serialization. Entries from older versions are never read again and expire
+after ``PRODUCT_CACHE_TTL`` seconds.
+
+Writes that skip model signals, such as ``QuerySet.update()``, must bump the
+versions themselves with ``ProductCacheVersion.bump()``.
+
+On a miss only one request per key and worker renders the response;
+concurrent requests in the same worker wait for it rather than all hitting
+the database at once.
+"""
+import hashlib
+import threading
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CATALOG = 'all'
+
+
+def list_scope(retailer_id=None):
+    return CATALOG if retailer_id is None else f'retailer:{retailer_id}'
+
+
+class _Render:
+    """A render in progress that other requests for the same key wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+
+
+class ProductResponseCache:
+    prefix = 'product-cache'
+
+    def __init__(self, ttl=None, lock_timeout=None):
+        self._ttl = ttl
+        self._lock_timeout = lock_timeout
+        self._renders = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _setting(self, value, name, default):
+        if value is not None:
+            return value
+        return getattr(settings, name, default)
+
+    @property
+    def ttl(self):
+        return self._setting(self._ttl, 'PRODUCT_CACHE_TTL', 300)
+
+    @property
+    def lock_timeout(self):
+        return self._setting(self._lock_timeout, 'PRODUCT_CACHE_LOCK_TIMEOUT', 5)
+
+    def generation(self, scope):
+        from .models import ProductCacheVersion
+
+        return ProductCacheVersion.current(scope)
+
+    def _shape(self, request):
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        # Next links and image URLs are absolute, so the host is part of the shape
+        return hashlib.sha1(f'{request.get_host()}?{query}'.encode()).hexdigest()
+
+    def list_key(self, request, retailer_id=None):
+        scope = list_scope(retailer_id)
+        return f'{self.prefix}:list:{scope}:{self.generation(scope)}:{self._shape(request)}'
+
+    def detail_key(self, request, pk):
+        scope = f'product:{pk}'
+        return f'{self.prefix}:detail:{pk}:{self.generation(scope)}:{self._shape(request)}'
+
+    def get(self, key):
+        entry = cache.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def render_once(self, key, render):
+        """Call ``render()`` and cache its result, unless a concurrent request already is"""
+        with self._lock:
+            pending = self._renders.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._renders[key] = _Render()
+        if not leader:
+            if pending.done.wait(self.lock_timeout) and pending.entry is not None:
+                return pending.entry
+            # The first render failed or is taking too long
+            return render()
+        try:
+            entry = pending.entry = render()
+            if entry is not None:
+                cache.set(key, entry, self.ttl)
+            return entry
+        finally:
+            with self._lock:
+                del self._renders[key]
+            pending.done.set()
+
+    def get_or_render(self, key, render):
+        """Cached entry for ``key``, calling ``render()`` on a miss"""
+        entry = self.get(key)
+        if entry is None:
+            entry = self.render_once(key, render)
+        return entry
+
+    def invalidate(self, product):
+        """Forget every cached response that may include ``product``"""
+        from .models import ProductCacheVersion
+
+        scopes = {CATALOG, list_scope(product.retailer_id), f'product:{product.pk}'}
+        if product._saved_retailer_id is not None:
+            # The retailer it had before, whose lists held it if it moved
+            scopes.add(list_scope(product._saved_retailer_id))
+        transaction.on_commit(lambda: ProductCacheVersion.bump(*scopes))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+response_cache = ProductResponseCache()
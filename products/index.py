@@ -0,0 +1,363 @@
+"""
+In-memory product catalog shared by every product lookup in a worker.
+
+``ProductIndex`` holds one snapshot of the catalog: an entry per product,
+the weighted terms of its name and description, and units ordered. The
+chatbot answers "do you have roses?" straight from it without a
+``LIKE '%rose%'`` scan per message. Storefront search and name suggestions
+are ``CatalogView`` subclasses that keep only the structures they add on
+top of the snapshot, and are told about every change to it.
+
+Saves and deletes in this process update it straight away through signals.
+Changes made by other processes are picked up by ``refresh()``, which checks
+a cheap ``(max(updated_at), count)`` stamp at most once per
+``PRODUCT_INDEX_CHECK_INTERVAL`` seconds, pulls only the rows updated and
+order items added since the last check, and rebuilds from scratch only when
+rows have disappeared.
+
+``updated_at`` is set when a row is saved, not when its transaction commits,
+so a slow transaction can publish a row dated before the last check, without
+moving the stamp. Pulls therefore reach back ``PRODUCT_INDEX_REFRESH_OVERLAP``
+seconds before the last check, and keep doing so until that much time has
+passed since the newest change; rows already pulled at the same
+``updated_at`` are skipped. Transactions open for longer than the overlap
+can still be missed until the next rebuild.
+
+A rebuild reads and indexes the products outside the lock and swaps the new
+snapshot in whole, so lookups keep answering from the old one meanwhile;
+changes made during the build are replayed onto the new snapshot. Units
+ordered are summed over every order item once, on the first load, and
+carried over by later rebuilds.
+"""
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from .text import tokenize
+
+NAME_WEIGHT = 2
+DESCRIPTION_WEIGHT = 1
+
+ProductEntry = namedtuple('ProductEntry', 'pk name price stock retailer_id')
+
+
+class CatalogSnapshot:
+    """Everything known about the catalog at one time, replaced whole on rebuild"""
+
+    def __init__(self, sold=None):
+        # pk -> ProductEntry
+        self.entries = {}
+        # term -> {pk: weight}
+        self.postings = {}
+        # pk -> {term: weight}
+        self.terms = {}
+        # pk -> sum of its term weights
+        self.lengths = {}
+        self.total_length = 0
+        # pk -> units ordered
+        self.sold = dict(sold or ())
+        # view name -> the structures that view keeps on top
+        self.views = {}
+
+    def put(self, product):
+        """Index or re-index one product, returning its previous entry and terms"""
+        old, old_terms = self.drop(product.pk)
+        weights = defaultdict(int)
+        for term in tokenize(product.name):
+            weights[term] += NAME_WEIGHT
+        for term in tokenize(product.description):
+            weights[term] += DESCRIPTION_WEIGHT
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[product.pk] = weight
+        self.terms[product.pk] = dict(weights)
+        length = sum(weights.values())
+        self.lengths[product.pk] = length
+        self.total_length += length
+        self.entries[product.pk] = ProductEntry(
+            product.pk, product.name, product.price, product.stock, product.retailer_id)
+        return old, old_terms
+
+    def drop(self, pk):
+        """Forget one product, returning its entry and terms"""
+        terms = self.terms.pop(pk, {})
+        for term in terms:
+            postings = self.postings[term]
+            del postings[pk]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(pk, 0)
+        return self.entries.pop(pk, None), terms
+
+    def add_sales(self, units):
+        for pk, quantity in units.items():
+            self.sold[pk] = self.sold.get(pk, 0) + quantity
+
+
+class ProductIndex:
+    fields = ('pk', 'name', 'description', 'price', 'stock', 'retailer_id', 'updated_at')
+
+    def __init__(self, check_interval=None, overlap=None):
+        self._check_interval = check_interval
+        self._overlap = overlap
+        self._snapshot = CatalogSnapshot()
+        self._views = []
+        self._watermark = None
+        # pk -> updated_at of the rows pulled within the overlap window
+        self._pulled = {}
+        self._sales_watermark = 0
+        self._loaded = False
+        self._checked_at = None
+        # Held for lookups and single changes, never while reading the database
+        self._lock = threading.RLock()
+        # One refresh or rebuild at a time
+        self._refresh_lock = threading.RLock()
+        # Changes made while a rebuild is reading, replayed onto its snapshot
+        self._pending = None
+        # Bumped on every change so callers can invalidate derived caches
+        self.generation = 0
+
+    @property
+    def check_interval(self):
+        if self._check_interval is not None:
+            return self._check_interval
+        return getattr(settings, 'PRODUCT_INDEX_CHECK_INTERVAL', 5)
+
+    @property
+    def overlap(self):
+        if self._overlap is not None:
+            return self._overlap
+        return timedelta(seconds=getattr(settings, 'PRODUCT_INDEX_REFRESH_OVERLAP', 30))
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def __len__(self):
+        return len(self._snapshot.entries)
+
+    def attach(self, view):
+        """Keep ``view``'s structures in step with this catalog"""
+        with self._lock:
+            self._views.append(view)
+            self._snapshot.views[view.name] = view.build(self._snapshot)
+
+    def _put(self, snapshot, product):
+        old, old_terms = snapshot.put(product)
+        for view in self._views:
+            view.changed(snapshot, product.pk, old, old_terms)
+
+    def _drop(self, snapshot, pk):
+        old, old_terms = snapshot.drop(pk)
+        if old is not None:
+            for view in self._views:
+                view.changed(snapshot, pk, old, old_terms)
+
+    def _sell(self, snapshot, units):
+        snapshot.add_sales(units)
+        for view in self._views:
+            view.sold(snapshot, units)
+
+    def _change(self, apply, *args):
+        with self._lock:
+            apply(self._snapshot, *args)
+            if self._pending is not None:
+                self._pending.append((apply, args))
+            self.generation += 1
+
+    def update(self, product):
+        """Index or re-index one product"""
+        self._change(self._put, product)
+
+    def remove(self, pk):
+        self._change(self._drop, pk)
+
+    def add_sales(self, units):
+        """Count ``{pk: units}`` more units ordered"""
+        self._change(self._sell, units)
+
+    def _build(self, products, sold):
+        snapshot = CatalogSnapshot(sold)
+        for product in products:
+            snapshot.put(product)
+        for view in list(self._views):
+            snapshot.views[view.name] = view.build(snapshot)
+        return snapshot
+
+    def _install(self, snapshot, pending=()):
+        """Swap ``snapshot`` in; the caller holds the lock"""
+        # Views attached while it was being built
+        for view in self._views:
+            if view.name not in snapshot.views:
+                snapshot.views[view.name] = view.build(snapshot)
+        for apply, args in pending:
+            apply(snapshot, *args)
+        self._snapshot = snapshot
+        self.generation += 1
+
+    def load(self, products, sold=None):
+        """Replace the catalog with ``products`` and ``{pk: units ordered}``"""
+        snapshot = self._build(products, sold)
+        with self._lock:
+            self._install(snapshot)
+
+    def _pull_sales(self, since):
+        OrderItem = apps.get_model('orders', 'OrderItem')
+        rows = (OrderItem.objects.filter(pk__gt=since).values('product')
+                .annotate(units=Sum('quantity'), last=Max('pk')))
+        units = {}
+        for row in rows:
+            units[row['product']] = row['units']
+            self._sales_watermark = max(self._sales_watermark, row['last'])
+        return units
+
+    def rebuild(self):
+        from .models import Product
+
+        with self._refresh_lock:
+            with self._lock:
+                self._pending = []
+                sold = dict(self._snapshot.sold) if self._loaded else None
+            try:
+                if sold is None:
+                    sold = self._pull_sales(0)
+                snapshot = self._build(Product.objects.only(*self.fields).iterator(), sold)
+                with self._lock:
+                    self._install(snapshot, self._pending)
+                    self._pending = None
+            finally:
+                self._pending = None
+            self._loaded = True
+
+    def search(self, text, limit=3, name_coverage=0.0):
+        """
+        Return up to ``limit`` in-stock products ranked by matching terms,
+        keeping only those whose name holds ``name_coverage`` of the terms
+        """
+        terms = tokenize(text)
+        scores = defaultdict(int)
+        with self._lock:
+            snapshot = self._snapshot
+            for term in terms:
+                for pk, weight in snapshot.postings.get(term, {}).items():
+                    scores[pk] += weight
+            entries = [entry for entry in map(snapshot.entries.get, scores) if entry.stock > 0]
+        if name_coverage:
+            needed = name_coverage * len(terms)
+            entries = [entry for entry in entries
+                       if len(terms & tokenize(entry.name)) >= needed]
+        entries.sort(key=lambda entry: (-scores[entry.pk], entry.name))
+        return entries[:limit]
+
+    def is_fresh(self):
+        return (self._checked_at is not None
+                and time.monotonic() - self._checked_at < self.check_interval)
+
+    def refresh(self):
+        """Bring the catalog up to date with changes made by any process"""
+        if self.is_fresh():
+            return self
+
+        from .models import Product
+
+        with self._refresh_lock:
+            if self.is_fresh():
+                return self
+            stamp = Product.objects.aggregate(latest=Max('updated_at'), total=Count('pk'))
+            if not self._loaded:
+                self.rebuild()
+            else:
+                if (stamp['latest'] != self._watermark or stamp['total'] != len(self)
+                        or self._in_overlap()):
+                    if self._watermark is not None:
+                        self._pull_changes(Product)
+                    # Anything still unaccounted for was deleted elsewhere
+                    if stamp['total'] != len(self):
+                        self.rebuild()
+                units = self._pull_sales(self._sales_watermark)
+                if units:
+                    self.add_sales(units)
+            self._watermark = stamp['latest']
+            self._checked_at = time.monotonic()
+        return self
+
+    def _in_overlap(self):
+        """Whether rows dated before the watermark may still be committing"""
+        return self._watermark is not None and timezone.now() - self._watermark < self.overlap
+
+    def _pull_changes(self, Product):
+        since = self._watermark - self.overlap
+        changed = Product.objects.filter(updated_at__gte=since).only(*self.fields)
+        for product in changed:
+            if self._pulled.get(product.pk) != product.updated_at:
+                self._pulled[product.pk] = product.updated_at
+                self.update(product)
+        self._pulled = {pk: updated_at for pk, updated_at in self._pulled.items()
+                        if updated_at >= since}
+
+    async def aget(self):
+        """Async variant of refresh() that skips the thread hop when fresh"""
+        if self.is_fresh():
+            return self
+        return await database_sync_to_async(self.refresh)()
+
+
+class CatalogView:
+    """
+    Structures kept on top of a ``ProductIndex`` snapshot. ``build()`` makes
+    them for a whole snapshot and ``changed()`` and ``sold()`` keep them in
+    step with single changes. Without a catalog the view gets one of its own.
+    """
+    name = None
+
+    def __init__(self, catalog=None, check_interval=None):
+        self.catalog = catalog if catalog is not None else ProductIndex(check_interval)
+        self.catalog.attach(self)
+
+    def build(self, snapshot):
+        raise NotImplementedError
+
+    def changed(self, snapshot, pk, old, old_terms):
+        """Product ``pk`` was indexed or dropped; ``old`` is its previous entry, if any"""
+
+    def sold(self, snapshot, units):
+        """``{pk: units}`` more units were ordered"""
+
+    @contextmanager
+    def reading(self):
+        """The current snapshot and this view's structures, held still"""
+        with self.catalog._lock:
+            snapshot = self.catalog.snapshot
+            yield snapshot, snapshot.views[self.name]
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def update(self, product):
+        self.catalog.update(product)
+
+    def remove(self, pk):
+        self.catalog.remove(pk)
+
+    def add_sales(self, units):
+        self.catalog.add_sales(units)
+
+    def load(self, products, sold=None):
+        self.catalog.load(products, sold)
+
+    def rebuild(self):
+        self.catalog.rebuild()
+
+    def refresh(self):
+        self.catalog.refresh()
+        return self
+
+
+product_index = ProductIndex()
@@ -0,0 +1,92 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from chat.management.commands.chatbot_loadtest import peak_rss_mb, percentile
+from products.models import Product
+from products.search import ProductSearchIndex
+
+FLOWERS = (
+    'rose tulip lily orchid peony daisy sunflower carnation lavender hydrangea '
+    'gerbera chrysanthemum iris magnolia marigold jasmine lotus dahlia freesia '
+    'gardenia anemone ranunculus protea camellia aster gladiolus'
+).split()
+COLOURS = 'red white pink yellow purple orange blue peach cream coral'.split()
+STYLES = 'bouquet arrangement basket vase bunch box wreath posy garland centerpiece'.split()
+OCCASIONS = ('birthday anniversary wedding valentine graduation sympathy mother '
+             'congratulation apology housewarming').split()
+
+
+def make_products(count, retailers, seed):
+    rng = random.Random(seed)
+    for pk in range(1, count + 1):
+        flower, colour, style = rng.choice(FLOWERS), rng.choice(COLOURS), rng.choice(STYLES)
+        yield Product(
+            pk=pk,
+            retailer_id=rng.randint(1, retailers),
+            name=f'{colour.title()} {flower.title()} {style.title()}',
+            description=(f'{rng.randint(6, 48)} fresh {colour} {flower}s for a '
+                         f'{rng.choice(OCCASIONS)}, with a {rng.choice(COLOURS)} ribbon'),
+            price=Decimal(rng.randint(500, 20000)) / 100,
+            stock=rng.choice((0, 0, 1, 5, 12, 40)),
+        )
+
+
+def misspell(word, rng):
+    """Swap two neighbouring letters, the commonest typing slip"""
+    i = rng.randrange(len(word) - 1)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def query_mix(rng):
+    return {
+        'one word': lambda: ({'text': rng.choice(FLOWERS)}),
+        'two words': lambda: ({'text': f'{rng.choice(COLOURS)} {rng.choice(FLOWERS)}'}),
+        'common word': lambda: ({'text': rng.choice(STYLES)}),
+        'typo': lambda: ({'text': f'{rng.choice(COLOURS)} {misspell(rng.choice(FLOWERS), rng)}'}),
+        'filtered': lambda: ({'text': f'{rng.choice(COLOURS)} {rng.choice(FLOWERS)}',
+                              'min_price': Decimal(20), 'max_price': Decimal(80),
+                              'in_stock': True}),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Measures product search index build time and query latency on synthetic products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--retailers', type=int, default=500)
+        parser.add_argument('--queries', type=int, default=500,
+                            help='Queries per kind')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        index = ProductSearchIndex()
+        started = time.perf_counter()
+        index.load(make_products(options['products'], options['retailers'], options['seed']))
+        build = time.perf_counter() - started
+        terms = list(index.catalog.snapshot.postings)
+        self.stdout.write(
+            f"Indexed {len(index)} products in {build:.1f}s "
+            f"({len(terms)} terms, peak RSS {peak_rss_mb():.0f} MB)")
+
+        # Per-term weights are computed on first use; time the steady state
+        for term in terms:
+            index.query(term)
+
+        rng = random.Random(options['seed'])
+        self.stdout.write(f"{'query':<12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, make_query in query_mix(rng).items():
+            timings = []
+            for _ in range(options['queries']):
+                params = make_query()
+                text = params.pop('text')
+                started = time.perf_counter()
+                index.query(text, **params)
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            self.stdout.write(
+                f'{name:<12} {percentile(timings, 50):>8.2f} {percentile(timings, 95):>8.2f} '
+                f'{percentile(timings, 99):>8.2f} {timings[-1]:>8.2f}')
@@ -0,0 +1,98 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from chat.management.commands.chatbot_loadtest import peak_rss_mb, percentile
+from products.management.commands.product_search_benchmark import (
+    COLOURS, FLOWERS, STYLES, make_products,
+)
+from products.suggest import ProductSuggestIndex
+
+
+def typed(word, rng):
+    """What the search box holds part way through typing ``word``"""
+    return word[:rng.randint(1, len(word))]
+
+
+def prefix_mix(rng):
+    return {
+        '1 letter': lambda: rng.choice(FLOWERS)[0],
+        '2 letters': lambda: rng.choice(FLOWERS)[:2],
+        '3 letters': lambda: rng.choice(STYLES)[:3],
+        'typing': lambda: typed(rng.choice(FLOWERS), rng),
+        'two words': lambda: f'{rng.choice(COLOURS)} {typed(rng.choice(FLOWERS), rng)}',
+    }
+
+
+class Command(BaseCommand):
+    help = 'Measures product suggestion index build time, lookup and update latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--retailers', type=int, default=500)
+        parser.add_argument('--queries', type=int, default=2000,
+                            help='Lookups per kind')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def report(self, name, timings):
+        timings.sort()
+        self.stdout.write(
+            f'{name:<12} {percentile(timings, 50):>8.3f} {percentile(timings, 95):>8.3f} '
+            f'{percentile(timings, 99):>8.3f} {timings[-1]:>8.3f}')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        count = options['products']
+        products = list(make_products(count, options['retailers'], options['seed']))
+        sold = {pk: rng.randint(0, 200) for pk in range(1, count + 1, 3)}
+
+        index = ProductSuggestIndex()
+        started = time.perf_counter()
+        index.load(products, sold)
+        build = time.perf_counter() - started
+        data = index.catalog.snapshot.views[index.name]
+        self.stdout.write(
+            f"Indexed {len(index)} products in {build:.1f}s ({len(data.keys)} keys, "
+            f"{len(data.top)} cached prefixes, peak RSS {peak_rss_mb():.0f} MB)")
+
+        self.stdout.write(f"{'lookup':<12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for name, make_prefix in prefix_mix(rng).items():
+            timings = []
+            for _ in range(options['queries']):
+                prefix = make_prefix()
+                started = time.perf_counter()
+                index.suggest(prefix, limit=8)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.report(name, timings)
+
+        # Incremental changes between lookups: restocks and renames, and new orders
+        restocks, sales = [], []
+        for _ in range(options['queries']):
+            product = rng.choice(products)
+            product.stock = rng.choice((0, 3, 25))
+            if rng.random() < 0.2:
+                product.name = (f'{rng.choice(COLOURS).title()} {rng.choice(FLOWERS).title()} '
+                                f'{rng.choice(STYLES).title()}')
+            product.price = Decimal(rng.randint(500, 20000)) / 100
+            started = time.perf_counter()
+            index.update(product)
+            restocks.append((time.perf_counter() - started) * 1000)
+
+            units = {rng.randint(1, count): rng.randint(1, 5)}
+            started = time.perf_counter()
+            index.add_sales(units)
+            sales.append((time.perf_counter() - started) * 1000)
+        self.report('save', restocks)
+        self.report('order', sales)
+
+        timings = []
+        for name, make_prefix in prefix_mix(rng).items():
+            for _ in range(options['queries'] // 5):
+                prefix = make_prefix()
+                started = time.perf_counter()
+                index.suggest(prefix, limit=8)
+                timings.append((time.perf_counter() - started) * 1000)
+        self.report('after edits', timings)
+        self.stdout.write(f'{len(data.top)} cached prefixes after edits')
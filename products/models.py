@@ -1,5 +1,6 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 
 class Product(models.Model):
@@ -14,10 +15,60 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Change detection for the in-memory product index
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+            # Keyset pagination of the product list, overall and per retailer
+            models.Index(fields=['created_at', 'id'], name='product_list_idx'),
+            models.Index(fields=['retailer', 'created_at', 'id'],
+                         name='product_retailer_list_idx'),
+        ]
+
+    # The retailer the row had when it was loaded or last saved, so moving a
+    # product can invalidate the previous retailer's cached lists too
+    _saved_retailer_id = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_retailer_id = instance.__dict__.get('retailer_id')
+        return instance
+
     def __str__(self):
         return self.name
 
 
+class ProductCacheVersion(models.Model):
+    """
+    Version stamp of one slice of the catalog (all products, a retailer's or
+    a single product), bumped whenever a product in it is saved or deleted
+    """
+    scope = models.CharField(max_length=64, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def current(cls, scope):
+        return cls.objects.filter(scope=scope).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def changed_at(cls, scope):
+        """When a product in ``scope`` was last saved or deleted, None if never"""
+        return cls.objects.filter(scope=scope).values_list('updated_at', flat=True).first()
+
+    @classmethod
+    def bump(cls, *scopes):
+        updated = cls.objects.filter(scope__in=scopes).update(
+            version=models.F('version') + 1, updated_at=timezone.now())
+        if updated < len(scopes):
+            for scope in scopes:
+                cls.objects.get_or_create(scope=scope, defaults={'version': 1})
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
+
 class Catalog(models.Model):
     retailer = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="catalogs")
@@ -0,0 +1,70 @@
+"""
+Keyset pagination for the product list.
+
+Products are listed newest first on ``(created_at, id)`` and each page
+starts strictly after the last row of the previous one, so page N costs the
+same as page 1 and rows added meanwhile never shift or repeat a page.
+"""
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from chat.cursors import InvalidCursor, decode_cursor, encode_cursor
+
+
+class ProductCursorPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 24
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def page_queryset(self, queryset, request):
+        """The requested page plus one row, which tells whether another page follows"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                created_at, pk = decode_cursor(cursor)
+            except InvalidCursor:
+                raise NotFound('Invalid cursor')
+            queryset = queryset.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, pk__lt=pk))
+        return queryset.order_by(*self.ordering)[:self.get_page_size(request) + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        limit = self.get_page_size(request)
+        rows = list(self.page_queryset(queryset, request))
+        self.next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            self.next_cursor = encode_cursor(rows[-1].created_at, rows[-1].pk)
+        return rows
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,238 @@
+"""
+Ranked product search for the storefront.
+
+``ProductSearchIndex`` ranks every product, in stock or not, with BM25 over
+the weighted name and description terms of the shared ``ProductIndex``
+snapshot, so searches never scan the products table. On top of the snapshot
+it only keeps the character bigrams of the vocabulary, the filter values of
+each product and the per-term weights computed so far.
+
+Query words that are not in the vocabulary are matched to known words that
+share enough character bigrams and are within one or two edits, adjacent
+swaps included ("tluip" finds "tulip"), scored down by the number of
+edits. Price, stock and retailer filters are checked against the in-memory
+entries while ranking.
+
+Ranking skips work the way MaxScore does: terms are scored highest bound
+first, and once the current top results beat anything the remaining terms
+could add, those terms only adjust the existing candidates instead of
+bringing in every product that contains them.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+from .index import CatalogView, product_index
+from .text import bm25_weight, idf, words
+
+# Cached BM25 term weights are recomputed once the average length drifts this much
+AVGDL_DRIFT = 0.05
+MAX_EXPANSIONS = 3
+# Typo candidates checked per unknown word, most shared bigrams first
+MAX_CANDIDATES = 50
+
+
+def bigrams(term):
+    padded = f' {term} '
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def max_edits(term):
+    """Typos tolerated in a word of this length"""
+    if len(term) < 4:
+        return 0
+    return 1 if len(term) < 7 else 2
+
+
+def edit_distance(a, b, limit):
+    """Edits (adjacent swaps count as one) between two words, or ``limit + 1`` past ``limit``"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+class SearchData:
+    """What search keeps on top of one catalog snapshot"""
+
+    def __init__(self):
+        # bigram -> vocabulary terms containing it
+        self.grams = defaultdict(set)
+        # pk -> (price as float, stock, retailer id) for filtering
+        self.facets = {}
+        # term -> ({pk: BM25 term-frequency weight}, largest weight), filled on first search
+        self.weights = {}
+        self.weights_avgdl = None
+
+
+def filter_values(entry):
+    return float(entry.price), entry.stock, entry.retailer_id
+
+
+class ProductSearchIndex(CatalogView):
+    name = 'search'
+
+    def build(self, snapshot):
+        data = SearchData()
+        for term in snapshot.postings:
+            for gram in bigrams(term):
+                data.grams[gram].add(term)
+        for pk, entry in snapshot.entries.items():
+            data.facets[pk] = filter_values(entry)
+        return data
+
+    def changed(self, snapshot, pk, old, old_terms):
+        data = snapshot.views[self.name]
+        new_terms = snapshot.terms.get(pk, {})
+        for term in old_terms.keys() | new_terms.keys():
+            data.weights.pop(term, None)
+        for term in old_terms.keys() - new_terms.keys():
+            if term in snapshot.postings:
+                continue
+            for gram in bigrams(term):
+                terms = data.grams[gram]
+                terms.discard(term)
+                if not terms:
+                    del data.grams[gram]
+        for term in new_terms.keys() - old_terms.keys():
+            for gram in bigrams(term):
+                data.grams[gram].add(term)
+        entry = snapshot.entries.get(pk)
+        if entry is None:
+            data.facets.pop(pk, None)
+        else:
+            data.facets[pk] = filter_values(entry)
+
+    def _term_weights(self, snapshot, data, term):
+        """
+        ``{pk: tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))}`` for one term,
+        with its largest value
+        """
+        lengths = snapshot.lengths
+        avgdl = (snapshot.total_length / len(lengths) if lengths else 0.0) or 1.0
+        if data.weights_avgdl is None or abs(avgdl - data.weights_avgdl) > AVGDL_DRIFT * data.weights_avgdl:
+            data.weights.clear()
+            data.weights_avgdl = avgdl
+        cached = data.weights.get(term)
+        if cached is None:
+            avgdl = data.weights_avgdl
+            weights = {
+                pk: bm25_weight(tf, lengths[pk], avgdl)
+                for pk, tf in snapshot.postings.get(term, {}).items()
+            }
+            cached = data.weights[term] = (weights, max(weights.values(), default=0.0))
+        return cached
+
+    def _similar_terms(self, snapshot, data, term):
+        """``[(known term, score factor)]`` within a few typos of ``term``, closest first"""
+        limit = max_edits(term)
+        if not limit:
+            return []
+        grams = bigrams(term)
+        shared = Counter()
+        for gram in grams:
+            shared.update(data.grams.get(gram, ()))
+        # Each edit spoils at most three bigrams
+        needed = max(len(grams) - 3 * limit, 1)
+        scored = []
+        for candidate, count in shared.most_common(MAX_CANDIDATES):
+            if count < needed:
+                break
+            distance = edit_distance(term, candidate, limit)
+            if distance <= limit:
+                scored.append((distance, -len(snapshot.postings[candidate]), candidate))
+        scored.sort()
+        return [(candidate, 1 - distance / (len(term) + 1))
+                for distance, _, candidate in scored[:MAX_EXPANSIONS]]
+
+    def _expand(self, snapshot, data, text):
+        """``([(term, factor)], corrections)`` for the words of a query"""
+        terms, corrections = [], {}
+        for term in dict.fromkeys(words(text)):
+            if term in snapshot.postings:
+                terms.append((term, 1.0))
+            else:
+                similar = self._similar_terms(snapshot, data, term)
+                if similar:
+                    corrections[term] = [candidate for candidate, _ in similar]
+                terms.extend(similar)
+        return terms, corrections
+
+    def _passing(self, data, weights, min_price, max_price, in_stock, retailer):
+        """The ``(pk, weight)`` pairs of products that pass the filters"""
+        if min_price is None and max_price is None and in_stock is None and retailer is None:
+            return weights.items()
+        low = -math.inf if min_price is None else float(min_price)
+        high = math.inf if max_price is None else float(max_price)
+        facets = data.facets
+        return [
+            (pk, weight) for pk, weight in weights.items()
+            if low <= (facet := facets[pk])[0] <= high
+            and (in_stock is None or (facet[1] > 0) == in_stock)
+            and (retailer is None or facet[2] == retailer)
+        ]
+
+    def query(self, text, limit=20, min_price=None, max_price=None, in_stock=None,
+              retailer=None):
+        """
+        Products matching any word of ``text``, best first, as ``[(entry, score)]``,
+        along with the typo corrections that were applied.
+        """
+        filters = (min_price, max_price, in_stock, retailer)
+        with self.reading() as (snapshot, data):
+            terms, corrections = self._expand(snapshot, data, text)
+            total = len(snapshot.entries)
+            ranked = []
+            for term, factor in terms:
+                weights, largest = self._term_weights(snapshot, data, term)
+                weight = idf(len(snapshot.postings.get(term, ())), total) * factor
+                ranked.append((weight * largest, weight, weights))
+            ranked.sort(key=itemgetter(0), reverse=True)
+
+            if len(ranked) == 1:
+                _, weight, weights = ranked[0]
+                best = heapq.nlargest(limit, self._passing(data, weights, *filters), key=itemgetter(1))
+                best = [(pk, weight * value) for pk, value in best]
+            else:
+                # Only products that pass the filters ever get a score
+                scores = {}
+                remaining = sum(bound for bound, _, _ in ranked)
+                pruning = False
+                for bound, weight, weights in ranked:
+                    if not pruning and len(scores) >= limit:
+                        # Products not seen yet can't reach the current top results
+                        pruning = heapq.nlargest(limit, scores.values())[-1] >= remaining
+                    remaining -= bound
+                    if not scores:
+                        scores = {pk: weight * value
+                                  for pk, value in self._passing(data, weights, *filters)}
+                    elif pruning:
+                        if len(weights) < len(scores):
+                            for pk, value in weights.items():
+                                if pk in scores:
+                                    scores[pk] += weight * value
+                        else:
+                            for pk in scores:
+                                value = weights.get(pk)
+                                if value is not None:
+                                    scores[pk] += weight * value
+                    else:
+                        get = scores.get
+                        for pk, value in self._passing(data, weights, *filters):
+                            scores[pk] = get(pk, 0.0) + weight * value
+                best = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+            return [(snapshot.entries[pk], score) for pk, score in best], corrections
+
+
+product_search = ProductSearchIndex(product_index)
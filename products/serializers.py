@@ -1,8 +1,34 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from .models import Product
+from .suggest import MAX_SUGGESTIONS
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = "__all__"
         read_only_fields = ["id", "retailer", "created_at", "updated_at"]
+
+
+class ProductListFilterSerializer(serializers.Serializer):
+    """Query parameters accepted by the product list"""
+    retailer = serializers.IntegerField(required=False, min_value=1)
+    min_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False, min_value=Decimal('0'))
+    max_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False, min_value=Decimal('0'))
+    in_stock = serializers.BooleanField(required=False, allow_null=True)
+
+
+class ProductSearchParamsSerializer(ProductListFilterSerializer):
+    """Query parameters accepted by the product search"""
+    q = serializers.CharField(max_length=200)
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=50, default=20)
+
+
+class ProductSuggestParamsSerializer(serializers.Serializer):
+    """Query parameters accepted by the name suggestions"""
+    q = serializers.CharField(max_length=100)
+    limit = serializers.IntegerField(
+        required=False, min_value=1, max_value=MAX_SUGGESTIONS, default=8)
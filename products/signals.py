@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import response_cache
+from .index import product_index
+from .models import Product
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    # Search and suggestions are views of the same catalog and follow it
+    product_index.update(instance)
+    response_cache.invalidate(instance)
+    instance._saved_retailer_id = instance.retailer_id
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    product_index.remove(instance.pk)
+    response_cache.invalidate(instance)
@@ -0,0 +1,207 @@
+"""
+Product name suggestions for the search box.
+
+``ProductSuggestIndex`` keeps a sorted array of ``(name from a word onwards,
+name)`` keys, so "bou" and "rose bou" both find "Red Rose Bouquet" with two
+bisects. Products sharing a name are suggested once, ranked by their best
+product: in stock first, then units ordered, then units in stock.
+
+Short prefixes match a large share of the array, so for any prefix matching
+more than ``SCAN_LIMIT`` keys the best ``CACHE_SIZE`` names are kept ready,
+filled when the index is built and adjusted in place as products change.
+Everything else is ranked straight from the array. Either way a keystroke
+never reaches the database.
+
+Products and units ordered come from the shared ``ProductIndex`` snapshot,
+which tells this index about every change; only the keys, ranks and cached
+lists above are kept here.
+"""
+import heapq
+from bisect import bisect_left, insort
+
+from .index import CatalogView, product_index
+from .text import TOKEN_RE
+
+# Prefixes matching more keys than this keep their best names cached
+SCAN_LIMIT = 256
+MAX_SUGGESTIONS = 10
+# Cached lists shrink as their names drop in rank and are refilled below MAX_SUGGESTIONS
+CACHE_SIZE = 32
+# Sorts after any key that starts with the prefix it is appended to
+PREFIX_END = '\U0010ffff'
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+def word_suffixes(name):
+    """The normalized name from each of its words onwards"""
+    return {name[match.start():] for match in TOKEN_RE.finditer(name)}
+
+
+def prefixes(name):
+    return {suffix[:end] for suffix in word_suffixes(name) for end in range(1, len(suffix) + 1)}
+
+
+class SuggestData:
+    """What suggestions keep on top of one catalog snapshot"""
+
+    def __init__(self):
+        # Sorted (key, name) pairs, one per word of each distinct name
+        self.keys = []
+        # name -> {pk: (out of stock, -units ordered, -stock, pk)}
+        self.names = {}
+        # name -> (out of stock, -units ordered, -stock, name) of its best product
+        self.ranks = {}
+        # name -> pk of its best product
+        self.best = {}
+        # prefix -> best ranks of the names it matches
+        self.top = {}
+
+
+def product_rank(snapshot, entry):
+    return (entry.stock <= 0, -snapshot.sold.get(entry.pk, 0), -entry.stock, entry.pk)
+
+
+class ProductSuggestIndex(CatalogView):
+    name = 'suggest'
+
+    def build(self, snapshot):
+        data = SuggestData()
+        # One sort instead of an insort per key
+        for entry in snapshot.entries.values():
+            name = normalize(entry.name)
+            if name:
+                data.names.setdefault(name, {})[entry.pk] = product_rank(snapshot, entry)
+        for name, products in data.names.items():
+            best = min(products.values())
+            data.ranks[name] = best[:3] + (name,)
+            data.best[name] = best[3]
+            data.keys.extend((suffix, name) for suffix in word_suffixes(name))
+        data.keys.sort()
+        self._fill_top(data)
+        return data
+
+    def _adjust_top(self, data, name, old, new):
+        """Move ``name`` from rank ``old`` to ``new`` in every cached list it may be in"""
+        for prefix in prefixes(name):
+            top = data.top.get(prefix)
+            if top is None:
+                continue
+            if old is not None:
+                position = bisect_left(top, old)
+                if position < len(top) and top[position] == old:
+                    del top[position]
+            # Names ranked below the last cached one may be outranked by uncached ones
+            if new is not None and top and new < top[-1]:
+                insort(top, new)
+                del top[CACHE_SIZE:]
+            if len(top) < MAX_SUGGESTIONS:
+                del data.top[prefix]
+
+    def _rerank(self, data, name):
+        old = data.ranks.get(name)
+        products = data.names.get(name)
+        new = None
+        if products:
+            best = min(products.values())
+            new = best[:3] + (name,)
+            data.ranks[name] = new
+            data.best[name] = best[3]
+        else:
+            data.ranks.pop(name, None)
+            data.best.pop(name, None)
+        if new != old:
+            self._adjust_top(data, name, old, new)
+
+    def _detach(self, data, pk, name):
+        products = data.names[name]
+        del products[pk]
+        if not products:
+            del data.names[name]
+            for suffix in word_suffixes(name):
+                del data.keys[bisect_left(data.keys, (suffix, name))]
+        self._rerank(data, name)
+
+    def _attach(self, snapshot, data, entry, name):
+        products = data.names.get(name)
+        if products is None:
+            products = data.names[name] = {}
+            for suffix in word_suffixes(name):
+                insort(data.keys, (suffix, name))
+        products[entry.pk] = product_rank(snapshot, entry)
+        self._rerank(data, name)
+
+    def changed(self, snapshot, pk, old, old_terms):
+        data = snapshot.views[self.name]
+        entry = snapshot.entries.get(pk)
+        old_name = old and normalize(old.name)
+        name = entry and normalize(entry.name)
+        if old_name and old_name == name:
+            # Same name, so the keys stay put and only its rank may change
+            data.names[name][pk] = product_rank(snapshot, entry)
+            self._rerank(data, name)
+            return
+        if old_name:
+            self._detach(data, pk, old_name)
+        if name:
+            self._attach(snapshot, data, entry, name)
+
+    def sold(self, snapshot, units):
+        data = snapshot.views[self.name]
+        for pk in units:
+            entry = snapshot.entries.get(pk)
+            name = entry and normalize(entry.name)
+            if name:
+                data.names[name][pk] = product_rank(snapshot, entry)
+                self._rerank(data, name)
+
+    def _fill_top(self, data, prefix='', lo=0, hi=None):
+        """
+        Cache the best names of every prefix that matches more than ``SCAN_LIMIT``
+        keys, each merged from the best names of its one letter longer prefixes.
+        """
+        keys, ranks = data.keys, data.ranks
+        if hi is None:
+            hi = len(keys)
+        if hi - lo <= SCAN_LIMIT:
+            return heapq.nsmallest(CACHE_SIZE, {ranks[name] for _, name in keys[lo:hi]})
+        depth = len(prefix)
+        candidates = set()
+        while lo < hi:
+            key, name = keys[lo]
+            if len(key) == depth:
+                candidates.add(ranks[name])
+                lo += 1
+                continue
+            child = key[:depth + 1]
+            end = bisect_left(keys, (child + PREFIX_END,), lo, hi)
+            candidates.update(self._fill_top(data, child, lo, end))
+            lo = end
+        top = heapq.nsmallest(CACHE_SIZE, candidates)
+        if prefix:
+            data.top[prefix] = top
+        return top
+
+    def suggest(self, text, limit=MAX_SUGGESTIONS):
+        """Best products whose name has a word starting with ``text``, one per name"""
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        with self.reading() as (snapshot, data):
+            keys = data.keys
+            lo = bisect_left(keys, (prefix,))
+            hi = bisect_left(keys, (prefix + PREFIX_END,), lo)
+            if hi - lo > SCAN_LIMIT:
+                top = data.top.get(prefix)
+                if top is None:
+                    top = data.top[prefix] = heapq.nsmallest(
+                        CACHE_SIZE, {data.ranks[name] for _, name in keys[lo:hi]})
+                top = top[:limit]
+            else:
+                top = heapq.nsmallest(limit, {data.ranks[name] for _, name in keys[lo:hi]})
+            return [snapshot.entries[data.best[rank[3]]] for rank in top]
+
+
+product_suggest = ProductSuggestIndex(product_index)
@@ -0,0 +1,44 @@
+"""
+Tokenizing and BM25 weighting shared by the product indexes and the
+chatbot's rule retrieval, so a word means the same thing to all of them.
+"""
+import math
+import re
+
+TOKEN_RE = re.compile(r'\w+')
+
+STOP_WORDS = frozenset(
+    'a an and any are can could do does for from have how i if in is it me my '
+    'of on or our please show the there this to we what when where which with '
+    'you your'.split()
+)
+
+K1 = 1.2
+B = 0.75
+
+
+def words(text):
+    """Lower-case word tokens in order, with stop words dropped and plurals folded"""
+    tokens = []
+    for token in TOKEN_RE.findall((text or '').lower()):
+        if token in STOP_WORDS:
+            continue
+        if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def tokenize(text):
+    """The distinct ``words()`` of ``text``"""
+    return set(words(text))
+
+
+def idf(documents, total):
+    """BM25 inverse document frequency of a term found in ``documents`` of ``total``"""
+    return math.log(1 + (total - documents + 0.5) / (documents + 0.5))
+
+
+def bm25_weight(tf, length, avgdl, k1=K1, b=B):
+    """BM25 term frequency weight in a document of ``length`` against the average ``avgdl``"""
+    return tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avgdl))
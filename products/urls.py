@@ -2,6 +2,8 @@ from django.urls import path
 from .views import (
     CreateProductView,
     ListProductsView,
+    SearchProductsView,
+    SuggestProductsView,
     RetrieveProductView,
     UpdateProductView,
     DeleteProductView,
@@ -11,6 +13,8 @@ from .views import (
 urlpatterns = [
     path("create/", CreateProductView.as_view(), name="create_product"),
     path("list/", ListProductsView.as_view(), name="list_products"),
+    path("search/", SearchProductsView.as_view(), name="search_products"),
+    path("suggest/", SuggestProductsView.as_view(), name="suggest_products"),
     path("<int:pk>/", RetrieveProductView.as_view(), name="retrieve_product"),
     path("<int:pk>/update/", UpdateProductView.as_view(), name="update_product"),
     path("<int:pk>/delete/", DeleteProductView.as_view(), name="delete_product"),
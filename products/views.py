@@ -1,10 +1,23 @@
 from rest_framework import generics, permissions
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+import hashlib
+
+from django.http import HttpResponse
 from django.shortcuts import render
-from .models import Product
-from .serializers import ProductSerializer
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .cache import list_scope, response_cache
+from .models import Product, ProductCacheVersion
+from .pagination import ProductCursorPagination
+from .search import product_search
+from .suggest import product_suggest
+from .serializers import (
+    ProductListFilterSerializer, ProductSearchParamsSerializer, ProductSerializer,
+    ProductSuggestParamsSerializer,
+)
 
 # 1️⃣ Create Product API
 
@@ -17,20 +30,173 @@ class CreateProductView(generics.CreateAPIView):
     def perform_create(self, serializer):
         serializer.save(retailer=self.request.user)
 
+
+def timestamp_us(value):
+    return int(value.timestamp() * 1000000)
+
+
+class CachedResponseMixin:
+    """
+    Serve successful JSON GETs from the product response cache, with
+    ETag/Last-Modified validators and 304 answers to conditional requests.
+    """
+
+    def response_cache_key(self, request, **kwargs):
+        raise NotImplementedError
+
+    def get_validators(self, request, **kwargs):
+        """``(etag, last modified timestamp)`` from a cheap query, or None if not found"""
+        raise NotImplementedError
+
+    def conditional_response(self, request, etag, last_modified, response):
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        return get_conditional_response(request, etag, last_modified, response)
+
+    def get(self, request, *args, **kwargs):
+        key = None
+        if request.accepted_renderer.format == 'json':
+            key = self.response_cache_key(request, **kwargs)
+        if key is None:
+            return super().get(request, *args, **kwargs)
+
+        entry = response_cache.get(key)
+        if entry is None:
+            validators = self.get_validators(request, **kwargs)
+            if validators is None:
+                return super().get(request, *args, **kwargs)
+            # Answer an unchanged client before serializing anything
+            response = self.conditional_response(request, *validators, HttpResponse())
+            if response.status_code != 200:
+                return response
+
+            def render_entry():
+                nonlocal response
+                response = super(CachedResponseMixin, self).get(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return None
+                return (*validators, JSONRenderer().render(response.data))
+
+            entry = response_cache.render_once(key, render_entry)
+            if entry is None:
+                return response
+
+        etag, last_modified, body = entry
+        return self.conditional_response(
+            request, etag, last_modified, HttpResponse(body, content_type='application/json'))
+
 # 2️⃣ List All Products API
 
 
-class ListProductsView(generics.ListAPIView):
-    queryset = Product.objects.all()
+class ListProductsView(CachedResponseMixin, generics.ListAPIView):
+    """Newest products first, cursor-paginated; filter by retailer, price and stock"""
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+
+    def response_cache_key(self, request, **kwargs):
+        retailer = request.query_params.get('retailer')
+        if retailer is None:
+            return response_cache.list_key(request)
+        try:
+            return response_cache.list_key(request, int(retailer))
+        except ValueError:
+            # Left to the filter validation, which answers 400
+            return None
+
+    def get_validators(self, request, **kwargs):
+        # The page's (id, updated_at) pairs straight from the list index
+        page = self.paginator.page_queryset(self.get_queryset(), request)
+        rows = [(pk, timestamp_us(updated_at))
+                for pk, updated_at in page.values_list('pk', 'updated_at')]
+        etag = hashlib.sha1(repr(rows).encode()).hexdigest()
+        # Deleting a listed product leaves no newer row behind, so the date
+        # comes from the catalog's version stamp, which deletes also move
+        retailer = request.query_params.get('retailer')
+        changed_at = ProductCacheVersion.changed_at(
+            list_scope(None if retailer is None else int(retailer)))
+        return f'"{etag}"', None if changed_at is None else int(changed_at.timestamp())
+
+    def get_queryset(self):
+        filters = ProductListFilterSerializer(data=self.request.query_params)
+        filters.is_valid(raise_exception=True)
+        filters = filters.validated_data
+
+        queryset = Product.objects.all()
+        if 'retailer' in filters:
+            queryset = queryset.filter(retailer_id=filters['retailer'])
+        if 'min_price' in filters:
+            queryset = queryset.filter(price__gte=filters['min_price'])
+        if 'max_price' in filters:
+            queryset = queryset.filter(price__lte=filters['max_price'])
+        if filters.get('in_stock') is True:
+            queryset = queryset.filter(stock__gt=0)
+        elif filters.get('in_stock') is False:
+            queryset = queryset.filter(stock=0)
+        return queryset
+
+
+class SearchProductsView(generics.GenericAPIView):
+    """Ranked, typo-tolerant product search served from the in-memory index"""
+
+    def get(self, request):
+        params = ProductSearchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        params = dict(params.validated_data)
+        text, limit = params.pop('q'), params.pop('limit')
+
+        hits, corrections = product_search.refresh().query(text, limit=limit, **params)
+        return Response({
+            'results': [
+                {
+                    'id': entry.pk,
+                    'name': entry.name,
+                    'price': str(entry.price),
+                    'stock': entry.stock,
+                    'retailer': entry.retailer_id,
+                    'score': round(score, 4),
+                }
+                for entry, score in hits
+            ],
+            'corrections': corrections,
+        })
+
+
+class SuggestProductsView(generics.GenericAPIView):
+    """Product names for the search box, answered from memory on every keystroke"""
+    # Suggestions are public; skip the user lookups of the default authenticators
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        params = ProductSuggestParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        entries = product_suggest.refresh().suggest(
+            params.validated_data['q'], limit=params.validated_data['limit'])
+        return Response({
+            'suggestions': [
+                {'id': entry.pk, 'name': entry.name, 'price': str(entry.price),
+                 'stock': entry.stock}
+                for entry in entries
+            ],
+        })
 
 # 3️⃣ Retrieve Single Product API
 
 
-class RetrieveProductView(generics.RetrieveAPIView):
+class RetrieveProductView(CachedResponseMixin, generics.RetrieveAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
 
+    def response_cache_key(self, request, pk):
+        return response_cache.detail_key(request, pk)
+
+    def get_validators(self, request, pk):
+        updated_at = Product.objects.filter(pk=pk).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            return None
+        return f'"{pk}-{timestamp_us(updated_at)}"', int(updated_at.timestamp())
+
 # 4️⃣ Update Product API (Only Owner Can Update)
 
 